@@ -1,6 +1,12 @@
 import streamlit as st
 import os
+import sys
+import time
+import logging
 import importlib
+from utils import images, question_bank, quota, search_cache, session_memory, warmup
+
+logger = logging.getLogger(__name__)
 
 # Custom CSS for improved styling
 def local_css(file_name):
@@ -36,13 +42,30 @@ def load_module(module_name):
     if module_name is None:
         return None
     try:
-        return importlib.import_module(f"pages.{module_name}")
+        name = f"pages.{module_name}"
+        cold = name not in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        if cold:
+            # Track first-visit cost; see benchmarks/bench_page_imports.py for the budget
+            logger.info(f"Cold load of {name} took {(time.perf_counter() - start) * 1000:.0f} ms")
+        return module
     except ImportError:
         st.error(f"Unable to load module: {module_name}. Make sure the file exists in the 'pages' directory.")
         return None
 
+# Operator dashboards on the home page are opt-in
+SHOW_ADMIN_DASHBOARD = os.getenv("SHERLOCK_ADMIN_DASHBOARD") == "1"
+
 def main():
-    st.image("https://upload.wikimedia.org/wikipedia/commons/c/cd/Sherlock_Holmes_Portrait_Paget.jpg", use_column_width=True)
+    warmup.start_background()
+    if "warmup_gate" not in st.session_state:
+        st.session_state.warmup_gate = True
+        if not warmup.wait(0):
+            with st.spinner("Loading models after a restart, this takes a moment..."):
+                warmup.wait(warmup.WARMUP_GATE_SECONDS)
+    session_memory.track_session()
+    st.image(images.local_image(images.SHERLOCK_PORTRAIT_URL), use_column_width=True)
     st.sidebar.title("S.H.E.R.L.O.C.K. 🕵️")
     st.sidebar.markdown("*Study Helper & Educational Resource for Learning & Observational Knowledge*")
     
@@ -131,12 +154,25 @@ def main():
                     <p>{get_feature_description(feature)}</p>
                 </div>
                 """, unsafe_allow_html=True)
+        
+        if SHOW_ADMIN_DASHBOARD:
+            with st.expander("Session memory"):
+                session_memory.render_memory_dashboard()
+            with st.expander("Warmup"):
+                warmup.render_readiness()
+            with st.expander("Question bank"):
+                question_bank.render_bank_dashboard()
+            with st.expander("Search cache"):
+                search_cache.render_search_cache_dashboard()
+            with st.expander("API quota"):
+                quota.render_quota_dashboard()
     else:
         st.title(f"{PAGES[selection]['icon']} {selection}")
         st.markdown(f"*{get_feature_description(selection)}*")
         st.markdown("---")
         
         # Load and run the selected module
+        quota.attribute(PAGES[selection]['module'])
         module = load_module(PAGES[selection]['module'])
         if module and hasattr(module, 'main'):
             module.main()
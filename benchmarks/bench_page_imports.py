@@ -0,0 +1,103 @@
+"""Cold import cost of each page on top of what app.py already loads.
+
+Every page is imported in a fresh interpreter under `-X importtime`. Only
+modules that app.py itself has not already imported are charged to the
+page, so the number is what a user waits for on their first visit. Exits
+non-zero when a page goes over the budget.
+
+Usage: python -m benchmarks.bench_page_imports [--budget-ms 300] [--repeat 3] [--top 5] [page ...]
+"""
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES_DIR = os.path.join(PROJECT_ROOT, "pages")
+APP_FILE = os.path.join(PROJECT_ROOT, "app.py")
+# Deferred imports keep every page well under this on a warm disk cache
+DEFAULT_BUDGET_MS = 300.0
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def baseline_imports():
+    """app.py's module-level import statements, as one line: what is loaded before any page."""
+    with open(APP_FILE, "r") as f:
+        tree = ast.parse(f.read())
+    return "; ".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(statement):
+    """Map each module imported by `statement` to its self time in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(1))
+    return times
+
+
+def page_cost(page, baseline_statement, baseline, repeat):
+    """Best-of-`repeat` cold cost of `page` in ms, with its heaviest new packages."""
+    best_ms, best_packages = None, None
+    for _ in range(repeat):
+        times = import_times(f"{baseline_statement}; import pages.{page}")
+        packages = defaultdict(int)
+        for module, self_us in times.items():
+            if module not in baseline:
+                packages[module.split(".")[0]] += self_us
+        total_ms = sum(packages.values()) / 1000
+        if best_ms is None or total_ms < best_ms:
+            best_ms, best_packages = total_ms, packages
+    return best_ms, best_packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pages", nargs="*", help="page modules to profile (default: all)")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = args.pages or sorted(name[:-3] for name in os.listdir(PAGES_DIR) if name.endswith(".py"))
+    baseline_statement = baseline_imports()
+    baseline = set(import_times(baseline_statement))
+
+    over_budget = []
+    for page in pages:
+        try:
+            cost_ms, packages = page_cost(page, baseline_statement, baseline, args.repeat)
+        except RuntimeError as e:
+            print(f"{page:>24}: {e}")
+            over_budget.append(page)
+            continue
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+        status = "OVER BUDGET" if cost_ms > args.budget_ms else "ok"
+        print(
+            f"{page:>24}: {cost_ms:7.1f} ms  {status:<11}  "
+            + ", ".join(f"{name} {us / 1000:.1f}ms" for name, us in heaviest)
+        )
+        if cost_ms > args.budget_ms:
+            over_budget.append(page)
+
+    if over_budget:
+        print(f"\n{len(over_budget)} page(s) over the {args.budget_ms:.0f} ms import budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"\nAll {len(pages)} pages within the {args.budget_ms:.0f} ms import budget")
+
+
+if __name__ == "__main__":
+    main()
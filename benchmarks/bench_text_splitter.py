@@ -0,0 +1,67 @@
+"""Compare RecursiveCharacterTextSplitter with ModelTokenTextSplitter.
+
+Usage: python -m benchmarks.bench_text_splitter [--size-mb 5]
+"""
+import argparse
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from utils.text_splitter import count_tokens, get_text_splitter
+
+
+def build_corpus(size_mb, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 11))) for _ in range(5000)]
+    target = int(size_mb * 1024 * 1024)
+    paragraphs = []
+    size = 0
+    while size < target:
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            words = [rng.choice(vocabulary) for _ in range(rng.randint(5, 30))]
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", "?", "!"]))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def time_split(splitter, text):
+    start = time.perf_counter()
+    chunks = splitter.split_text(text)
+    return chunks, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=5.0)
+    args = parser.parse_args()
+
+    text = build_corpus(args.size_mb)
+    print(f"Corpus: {len(text) / 1024 / 1024:.1f} MB")
+
+    baseline = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    token_splitter = get_text_splitter()
+
+    # Load the tokenizer outside the timed region
+    count_tokens("warmup")
+
+    results = {}
+    for name, splitter in [("recursive (chars)", baseline), ("model tokens", token_splitter)]:
+        chunks, elapsed = time_split(splitter, text)
+        results[name] = chunks
+        sizes = [count_tokens(chunk) for chunk in chunks[:200]]
+        print(
+            f"{name:>18}: {elapsed:7.2f}s  {len(chunks):6d} chunks  "
+            f"{len(text) / elapsed / 1024 / 1024:6.2f} MB/s  "
+            f"max tokens in first 200 chunks: {max(sizes)}"
+        )
+
+    again, _ = time_split(token_splitter, text)
+    print(f"Deterministic boundaries: {again == results['model tokens']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Recall@k, query latency and memory of the adaptive index types against exact search.
+
+Usage: python -m benchmarks.bench_vector_index [--n 100000] [--dim 768] [--k 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.vector_index import IndexSpec, RerankedIndex, build_faiss_index, choose_index_spec, memory_report
+
+
+def clustered_vectors(n, dim, n_clusters=256, seed=0):
+    # Real chunk embeddings are clustered by topic, so uniform noise would understate IVF recall
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, size=n)
+    return centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype("float32")
+
+
+def run_queries(index, queries, k):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    return np.array(found), np.array(latencies)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    vectors = clustered_vectors(args.n, args.dim)
+    queries = clustered_vectors(args.queries, args.dim, seed=1)
+
+    specs = [
+        IndexSpec("flat", args.dim, args.n),
+        choose_index_spec(args.n, args.dim, latency_target_ms=50, quantization=None),
+        choose_index_spec(args.n, args.dim, latency_target_ms=5, quantization=None),
+        choose_index_spec(args.n, args.dim, latency_target_ms=50, quantization="int8"),
+        choose_index_spec(args.n, args.dim, latency_target_ms=50, quantization="pq"),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vectors_path = os.path.join(tmp, "vectors.npy")
+        np.save(vectors_path, vectors)
+
+        truth = None
+        for spec in specs:
+            start = time.perf_counter()
+            index = build_faiss_index(vectors, spec)
+            build_s = time.perf_counter() - start
+            report = memory_report(index, spec)
+            if spec.quantization:
+                index = RerankedIndex(index, vectors_path)
+            found, latencies = run_queries(index, queries, args.k)
+            if truth is None:
+                truth = found
+            print(
+                f"{spec.kind:>8}/{report['quantization']:<4} (nlist={spec.nlist}, nprobe={spec.nprobe}, M={spec.hnsw_m}): "
+                f"build {build_s:6.1f}s  recall@{args.k} {recall_at_k(found, truth):.3f}  "
+                f"p50 {np.percentile(latencies, 50):6.2f}ms  p95 {np.percentile(latencies, 95):6.2f}ms  "
+                f"{report['index_bytes_per_chunk']:7.0f} B/chunk in memory "
+                f"(float32: {report['float32_bytes_per_chunk']})"
+            )
+
+
+if __name__ == "__main__":
+    main()
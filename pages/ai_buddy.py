@@ -1,32 +1,32 @@
 import streamlit as st
 import random
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
 import os
 from dotenv import load_dotenv
-import pandas as pd
 from datetime import datetime
-import plotly.express as px
-import json
+import base64
+import io
 import tempfile
 import time
-import numpy as np
-import threading
-import sounddevice as sd
-from playsound import playsound
-import pygame
-from scipy.io import wavfile
-from together import Together
-from streamlit.runtime.scriptrunner import RerunData, RerunException
-from streamlit.source_util import get_pages
-
-pygame.mixer.init()
+
+# pygame, scipy, numpy and the Together SDK are imported where they are used,
+# so loading this page stays fast and no audio device is opened until needed.
 
 # Load environment variables
 load_dotenv()
 
 # Initialize the Together client
-client = Together(api_key=os.environ.get('TOGETHER_API_KEY'))
+@st.cache_resource
+def get_client():
+    from together import Together
+
+    return Together(api_key=os.environ.get('TOGETHER_API_KEY'))
+
+def get_pygame():
+    import pygame
+
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    return pygame
 
 # Expanded Therapy techniques
 THERAPY_TECHNIQUES = {
@@ -54,7 +54,7 @@ def get_ai_response(user_input, buddy_config, therapy_technique=None):
         {"role": "user", "content": user_input}
     ]
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="meta-llama/Meta-Llama-3-8B-Instruct-Lite",
         messages=messages,
         max_tokens=512,
@@ -69,10 +69,16 @@ def get_ai_response(user_input, buddy_config, therapy_technique=None):
     return response
 
 def play_sound_loop(sound_file, stop_event):
+    from playsound import playsound
+
     while not stop_event.is_set():
         playsound(sound_file)
 
 def play_sound_for_duration(sound_file, duration):
+    from playsound import playsound
+
+    pygame = get_pygame()
+
     start_time = time.time()
     while time.time() - start_time < duration:
         playsound(sound_file, block=False)
@@ -100,6 +106,8 @@ SOUND_OPTIONS = [
 ]
 
 def show_meditation_timer():
+    pygame = get_pygame()
+
     st.subheader("🧘‍♀️ Enhanced Meditation Timer")
     
     sound_dir = os.path.join(os.path.dirname(__file__), "..", "sounds")
@@ -251,6 +259,8 @@ def show_personalized_recommendations():
             st.markdown(f"- {rec}")
 
 def generate_binaural_beat(freq1, freq2, duration_seconds, sample_rate=44100):
+    import numpy as np
+
     t = np.linspace(0, duration_seconds, int(sample_rate * duration_seconds), False)
     left_channel = np.sin(2 * np.pi * freq1 * t)
     right_channel = np.sin(2 * np.pi * freq2 * t)
@@ -262,6 +272,10 @@ def get_binary_file_downloader_html(bin_file, file_label='File'):
     return f'<a href="data:application/octet-stream;base64,{b64}" download="{file_label}.wav" class="download-link">Download {file_label}</a>'
 
 def show_binaural_beats():
+    from scipy.io import wavfile
+
+    pygame = get_pygame()
+
     st.subheader("🎵 Binaural Beats Generator")
     
     st.markdown("""
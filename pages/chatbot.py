@@ -1,23 +1,9 @@
 import streamlit as st
-import random
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 import os
 from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from utils import google_api, quota, search_cache
+from utils.models import get_embeddings
 import time
-from langchain.schema import Document
-from docx import Document as DocxDocument
-from PyPDF2 import PdfReader
 import io
 
 # Load environment variables
@@ -35,6 +21,8 @@ if "messages" not in st.session_state:
 # Initialize the Falcon model
 @st.cache_resource
 def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
     return ChatOpenAI(
         model="tiiuae/falcon-180B-chat",
         api_key=AI71_API_KEY,
@@ -42,12 +30,14 @@ def get_llm():
         streaming=True,
     )
 
-# Initialize embeddings
-@st.cache_resource
-def get_embeddings():
-    return HuggingFaceEmbeddings()
-
 def process_documents(uploaded_files):
+    from docx import Document as DocxDocument
+    from langchain.chains import RetrievalQA
+    from langchain.schema import Document
+    from PyPDF2 import PdfReader
+    from utils.hybrid_retriever import build_hybrid_retriever
+    from utils.text_splitter import get_text_splitter
+
     documents = []
     for uploaded_file in uploaded_files:
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
@@ -75,11 +65,10 @@ def process_documents(uploaded_files):
     if not documents:
         return None
     
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter()
     texts = text_splitter.split_documents(documents)
     
-    vectorstore = FAISS.from_documents(texts, get_embeddings())
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    retriever = build_hybrid_retriever(texts, get_embeddings(), k=3)
     
     qa_chain = RetrievalQA.from_chain_type(
         llm=get_llm(),
@@ -91,11 +80,17 @@ def process_documents(uploaded_files):
     return qa_chain
 
 def get_chatbot_response(user_input, qa_chain=None, personality="default", web_search=False):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_message = get_personality_prompt(personality)
     
     web_info = ""
     if web_search:
-        web_results = search_web_duckduckgo(user_input)
+        try:
+            web_results = search_web_duckduckgo(user_input)
+        except quota.QuotaExceeded as e:
+            st.warning(f"{e}. Answering without a web search.")
+            web_results = []
         web_info = "\n\n".join([f"Title: {result['title']}\nLink: {result['link']}\nSnippet: {result['snippet']}" for result in web_results])
         user_input += f"\n\nWeb search results:\n{web_info}"
     
@@ -124,13 +119,27 @@ def get_personality_prompt(personality):
     return personalities.get(personality, personalities["default"])
 
 def search_web_duckduckgo(query: str, num_results: int = 3, max_retries: int = 3):
-    api_key = os.getenv('api_key')
     cse_id = os.getenv('cse_id')
+    try:
+        return search_cache.cached(
+            "customsearch", {"q": query, "cx": cse_id, "num": num_results},
+            lambda: custom_search(query, cse_id, num_results, max_retries)
+        )
+    except quota.QuotaExceeded:
+        raise
+    except Exception:
+        print("Max retries reached. No results found.")
+        return []
+
+def custom_search(query: str, cse_id: str, num_results: int, max_retries: int):
+    from googleapiclient.errors import HttpError
+
+    api_key = os.getenv('api_key')
     
     for attempt in range(max_retries):
         try:
-            service = build("customsearch", "v1", developerKey=api_key)
-            res = service.cse().list(q=query, cx=cse_id, num=num_results).execute()
+            with google_api.service("customsearch", "v1", api_key) as service:
+                res = service.cse().list(q=query, cx=cse_id, num=num_results).execute()
             results = []
             if "items" in res:
                 for item in res["items"]:
@@ -143,11 +152,15 @@ def search_web_duckduckgo(query: str, num_results: int = 3, max_retries: int = 3
             return results
         except HttpError as e:
             print(f"HTTP error occurred: {e}. Attempt {attempt + 1} of {max_retries}")
+            if attempt + 1 == max_retries:
+                raise
         except Exception as e:
             print(f"An unexpected error occurred: {e}. Attempt {attempt + 1} of {max_retries}")
+            if attempt + 1 == max_retries:
+                raise
         time.sleep(2 ** attempt)
-    print("Max retries reached. No results found.")
-    return []
+        # Only the first attempt is charged by search_cache
+        quota.charge("customsearch", 1)
 
 def main():
     st.set_page_config(page_title="S.H.E.R.L.O.C.K. Chatbot", page_icon="🕵️", layout="wide")
@@ -226,6 +239,8 @@ def main():
                 st.text(f"{message['role']}: {message['content'][:50]}...")
         
         if st.session_state.messages:
+            import pandas as pd
+
             chat_history_df = pd.DataFrame(st.session_state.messages)
             csv = chat_history_df.to_csv(index=False)
             st.download_button(
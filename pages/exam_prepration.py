@@ -1,21 +1,13 @@
 import streamlit as st
 import random
+import re
 import time
-from typing import List, Dict
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_community.graphs import NetworkxEntityGraph
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 import os
 from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
+from utils.models import get_embeddings
+from utils import fetch, google_api, images, jobs, question_bank, quota, scrape, search_cache
 
 # Load environment variables
 load_dotenv()
@@ -26,16 +18,34 @@ GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 
+# Custom Search and YouTube calls share this host's fetch.host_slot limit
+GOOGLE_API_HOST = "https://www.googleapis.com"
+# Sites that haven't answered by then are left out of the results
+RESOURCE_DEADLINE_SECONDS = 45
+# Characters of page text shown on each resource card
+RESOURCE_SNIPPET_CHARS = 500
+# Sites covered by one Custom Search call ("site:a OR site:b ..."), the most
+# results a call returns; this keeps a search at a few calls instead of one per site
+SITES_PER_QUERY = 10
+
+# Larger question sets are split into parallel shards of this size
+QUESTIONS_PER_SHARD = 5
+QUESTION_DEADLINE_SECONDS = 120
+# Cosine similarity above which two questions count as the same question
+DUPLICATE_SIMILARITY = 0.9
+QUESTION_PATTERN = re.compile(r"^\s*\**Q\d+[.:)]\**\s*(.+?)(?:^\s*\**A\d+[.:)]\**\s*(.+?))?(?=^\s*\**Q\d+[.:)]|\Z)", re.M | re.S)
+
 # Initialize the Falcon model
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    streaming=True,
-)
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
 
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings()
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        streaming=True,
+    )
 
 FIELDS = [
     "Mathematics", "Physics", "Chemistry", "Biology", "Computer Science",
@@ -85,6 +95,18 @@ EDUCATIONAL_RESOURCES = [
 ]
 
 def search_web(query: str, num_results: int = 30, max_retries: int = 3) -> List[Dict[str, str]]:
+    try:
+        return search_cache.cached(
+            "customsearch", {"q": query, "cx": GOOGLE_CSE_ID, "num": num_results},
+            partial(custom_search, query, num_results, max_retries)
+        )
+    except quota.QuotaExceeded:
+        raise
+    except Exception as e:
+        print(f"Max retries reached. No results found. ({e})")
+        return []
+
+def custom_search(query: str, num_results: int, max_retries: int) -> List[Dict[str, str]]:
     user_agents = [
         'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Safari/605.1.15',
@@ -94,8 +116,8 @@ def search_web(query: str, num_results: int = 30, max_retries: int = 3) -> List[
     for attempt in range(max_retries):
         try:
             headers = {'User-Agent': random.choice(user_agents)}
-            service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY)
-            res = service.cse().list(q=query, cx=GOOGLE_CSE_ID, num=num_results).execute()
+            with google_api.service("customsearch", "v1", GOOGLE_API_KEY) as service:
+                res = service.cse().list(q=query, cx=GOOGLE_CSE_ID, num=num_results).execute()
             
             results = []
             if "items" in res:
@@ -110,21 +132,21 @@ def search_web(query: str, num_results: int = 30, max_retries: int = 3) -> List[
             return results
         except Exception as e:
             print(f"An error occurred: {e}. Attempt {attempt + 1} of {max_retries}")
+            if attempt + 1 == max_retries:
+                raise
             time.sleep(2 ** attempt)
-    
-    print("Max retries reached. No results found.")
-    return []
+            # search_cache charged the first attempt; every retry is a billed call too
+            quota.charge("customsearch", 1)
 
-def scrape_webpage(url: str) -> str:
-    try:
-        response = requests.get(url, timeout=10)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        return soup.get_text()
-    except Exception as e:
-        print(f"Error scraping {url}: {e}")
-        return ""
+def scrape_webpage(url: str, max_chars: int = RESOURCE_SNIPPET_CHARS) -> str:
+    return scrape.visible_text(url, max_chars=max_chars)
 
 def process_documents(uploaded_files):
+    from langchain.chains import RetrievalQA
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
+    from utils.hybrid_retriever import build_hybrid_retriever
+    from utils.text_splitter import get_text_splitter
+
     documents = []
     for uploaded_file in uploaded_files:
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
@@ -141,26 +163,25 @@ def process_documents(uploaded_files):
         
         documents.extend(loader.load())
     
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter()
     texts = text_splitter.split_documents(documents)
     
-    vectorstore = FAISS.from_documents(texts, embeddings)
-    graph = NetworkxEntityGraph()
-    graph.add_documents(texts)
-    
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    retriever = build_hybrid_retriever(texts, get_embeddings(), k=5)
     
     qa_chain = RetrievalQA.from_chain_type(
-        llm=chat,
+        llm=get_llm(),
         chain_type="stuff",
         retriever=retriever,
         return_source_documents=True
     )
     
-    return qa_chain, graph
+    return qa_chain
+
+def generate_questions(topic, difficulty, num_questions, include_answers, focus=None):
+    from langchain.schema import HumanMessage, SystemMessage
 
-def generate_questions(topic, difficulty, num_questions, include_answers, qa_chain=None, graph=None):
     system_prompt = f"""You are an expert exam question generator. Generate {num_questions} {difficulty}-level questions about {topic}. 
+    {f"Focus only on this aspect of the topic: {focus}." if focus else ""}
     {"Each question should be followed by its correct answer." if include_answers else "Do not include answers."}
     Format your response as follows:
     Q1. [Question]
@@ -170,37 +191,158 @@ def generate_questions(topic, difficulty, num_questions, include_answers, qa_cha
     ... and so on.
     """
     
-    if qa_chain and graph:
-        context = graph.get_relevant_documents(topic)
-        context_text = "\n".join([doc.page_content for doc in context])
-        
-        result = qa_chain({"query": system_prompt, "context": context_text})
-        questions = result['result']
+    messages = [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=f"Please generate {num_questions} {difficulty} questions about {topic}.")
+    ]
+    return get_llm().invoke(messages).content
+
+def plan_subtopics(topic: str, count: int) -> List[str]:
+    """Ask for `count` distinct subtopics to spread a large question set over."""
+    from langchain.schema import HumanMessage
+
+    prompt = f"List {count} distinct subtopics of {topic} that an exam could cover, one per line, with no numbering or commentary."
+    try:
+        reply = get_llm().invoke([HumanMessage(content=prompt)]).content
+    except Exception as e:
+        print(f"Could not plan subtopics for {topic}: {e}")
+        return []
+    subtopics = [re.sub(r"^[\s*#\-\d.)]+", "", line).strip() for line in reply.splitlines()]
+    return [subtopic for subtopic in subtopics if subtopic][:count]
+
+def parse_questions(text: str) -> List[Dict[str, str]]:
+    """Split "Q1. ... A1. ..." output into question/answer pairs."""
+    questions = []
+    for match in QUESTION_PATTERN.finditer(text):
+        question, answer = match.group(1).strip(), (match.group(2) or "").strip()
+        if question:
+            questions.append({"question": question, "answer": answer})
+    return questions
+
+def dedupe_questions(candidates: List[Dict[str, str]], accepted_vectors: list) -> list:
+    """(question, vector) pairs for candidates not too close to an accepted question (or to each other)."""
+    import numpy as np
+
+    if not candidates:
+        return []
+    vectors = np.asarray(get_embeddings().embed_documents([q["question"] for q in candidates]), dtype="float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    kept = []
+    for question, vector in zip(candidates, vectors):
+        if accepted_vectors and float(np.max(np.asarray(accepted_vectors) @ vector)) >= DUPLICATE_SIMILARITY:
+            continue
+        accepted_vectors.append(vector)
+        kept.append((question, vector))
+    return kept
+
+def format_question(number: int, question: Dict[str, str], include_answers: bool) -> str:
+    text = f"**Q{number}.** {question['question']}"
+    if include_answers and question["answer"]:
+        text += f"  \n**A{number}.** {question['answer']}"
+    return text
+
+def generate_question_set(topic, difficulty, num_questions, include_answers, progress=None,
+                          emit=None) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Serve what the question bank has, then generate the shortfall as parallel shards, one per subtopic.
+
+    Questions are deduped and numbered as shards finish; new ones go into the bank.
+    Also returns the raw text of shards whose reply didn't follow the Q1./A1.
+    format, so it can still be shown.
+    """
+    accepted, accepted_vectors = [], []
+    for question, vector in question_bank.sample(topic, difficulty, include_answers, num_questions):
+        accepted.append(question)
+        accepted_vectors.append(vector)
+        if emit:
+            emit(format_question(len(accepted), question, include_answers))
+    banked = len(accepted)
+    shortfall = num_questions - banked
+    if not shortfall:
+        question_bank.record(num_questions, banked)
+        return accepted, []
+
+    num_shards = -(-shortfall // QUESTIONS_PER_SHARD)
+    if num_shards == 1:
+        shards = [(None, shortfall)]
     else:
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=f"Please generate {num_questions} {difficulty} questions about {topic}.")
+        if progress:
+            progress(0.0, "Planning subtopics")
+        subtopics = plan_subtopics(topic, num_shards)
+        # A little slack per shard makes up for questions dropped as duplicates
+        shards = [
+            (subtopics[i] if i < len(subtopics) else f"part {i + 1} of {num_shards}, distinct from the other parts",
+             min(QUESTIONS_PER_SHARD, shortfall - i * QUESTIONS_PER_SHARD) + 1)
+            for i in range(num_shards)
         ]
-        questions = chat(messages).content
-    
-    return questions
 
-def gather_resources(field: str) -> List[Dict[str, str]]:
+    def run_shard(focus, count):
+        with fetch.host_slot(AI71_BASE_URL):
+            reply = generate_questions(topic, difficulty, count, include_answers, focus=focus)
+        return parse_questions(reply), reply
+
+    tasks = [(focus, partial(run_shard, focus, count)) for focus, count in shards]
+    generated, unparsed = [], []
+    for done, (focus, (candidates, reply)) in enumerate(fetch.gather(tasks, deadline=QUESTION_DEADLINE_SECONDS), start=1):
+        if not candidates and reply.strip():
+            unparsed.append(reply.strip())
+            if emit:
+                emit(reply.strip())
+        kept = dedupe_questions(candidates, accepted_vectors)
+        # Spare questions beyond this request are still worth banking
+        generated.extend(kept)
+        for question, _ in kept:
+            if len(accepted) == num_questions:
+                break
+            accepted.append(question)
+            if emit:
+                emit(format_question(len(accepted), question, include_answers))
+        if progress:
+            progress(done / len(tasks), f"Finished {focus or topic}")
+
+    question_bank.add(topic, difficulty, generated)
+    question_bank.record(num_questions, banked)
+    return accepted, unparsed
+
+def question_set_job(ctx, topic, difficulty, num_questions, include_answers) -> str:
+    questions, unparsed = generate_question_set(
+        topic, difficulty, num_questions, include_answers, progress=ctx.report, emit=ctx.emit
+    )
+    formatted = [format_question(i, question, include_answers) for i, question in enumerate(questions, start=1)]
+    return "\n\n".join(formatted + unparsed)
+
+def site_key(url: str) -> str:
+    return re.sub(r"^https?://(www\.)?", "", url.lower()).rstrip("/")
+
+def search_sites(sites: List[str], field: str) -> List[Dict[str, str]]:
+    """The top search result from each of `sites` that has one, from a single query restricted to all of them."""
+    query = f"{field} ({' OR '.join(f'site:{site}' for site in sites)})"
+    with fetch.host_slot(GOOGLE_API_HOST):
+        search_results = search_web(query, num_results=SITES_PER_QUERY)
+    firsts = {}
+    for result in search_results:
+        link = site_key(result['link'])
+        site = next((site for site in sites if link.startswith(site_key(site))), None)
+        if site is not None and site not in firsts:
+            firsts[site] = result
+    return list(firsts.values())
+
+def site_resource(result: Dict[str, str]) -> Dict[str, str]:
+    with fetch.host_slot(result['link']):
+        # One extra character tells us whether the text was cut short
+        content = scrape_webpage(result['link'], max_chars=RESOURCE_SNIPPET_CHARS + 1)
+    return {
+        "title": result['title'],
+        "link": result['link'],
+        "content": content[:RESOURCE_SNIPPET_CHARS] + "..." if len(content) > RESOURCE_SNIPPET_CHARS else content
+    }
+
+def search_youtube(query: str, max_results: int = 5) -> Dict:
+    with fetch.host_slot(GOOGLE_API_HOST), google_api.service('youtube', 'v3', YOUTUBE_API_KEY) as youtube:
+        return youtube.search().list(q=query, type='video', part='id,snippet', maxResults=max_results).execute()
+
+def find_youtube_resources(field: str) -> List[Dict[str, str]]:
+    youtube_results = search_cache.cached("youtube", {"q": field, "maxResults": 5}, partial(search_youtube, field))
     resources = []
-    for resource_url in EDUCATIONAL_RESOURCES:
-        search_results = search_web(f"site:{resource_url} {field}", num_results=1)
-        if search_results:
-            result = search_results[0]
-            content = scrape_webpage(result['link'])
-            resources.append({
-                "title": result['title'],
-                "link": result['link'],
-                "content": content[:500] + "..." if len(content) > 500 else content
-            })
-    
-    # YouTube search
-    youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
-    youtube_results = youtube.search().list(q=field, type='video', part='id,snippet', maxResults=5).execute()
     for item in youtube_results.get('items', []):
         video_id = item['id']['videoId']
         resources.append({
@@ -209,9 +351,70 @@ def gather_resources(field: str) -> List[Dict[str, str]]:
             "content": item['snippet']['description'],
             "thumbnail": item['snippet']['thumbnails']['medium']['url']
         })
-    
+    # Already on a fetch worker, so the few thumbnails are cached in turn
+    for resource in resources:
+        images.fetch_image(resource["thumbnail"])
     return resources
 
+def gather_resources(field: str, progress=None, emit=None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+    """Search the sites, a group at a time, and YouTube at once; then read the pages found.
+
+    Resources are returned (and emitted) as they arrive. Also returns why
+    some sources were skipped when API quota ran out, or None.
+    """
+    deadline = time.monotonic() + RESOURCE_DEADLINE_SECONDS
+    quota_errors = []
+
+    def within_quota(find, *args):
+        try:
+            return find(*args)
+        except quota.QuotaExceeded as e:
+            quota_errors.append(str(e))
+            return []
+
+    tasks = [
+        (f"sites {i + 1}-{min(i + SITES_PER_QUERY, len(EDUCATIONAL_RESOURCES))}",
+         partial(within_quota, search_sites, EDUCATIONAL_RESOURCES[i:i + SITES_PER_QUERY], field))
+        for i in range(0, len(EDUCATIONAL_RESOURCES), SITES_PER_QUERY)
+    ]
+    tasks.append(("youtube", partial(within_quota, find_youtube_resources, field)))
+
+    resources, pages = [], []
+    for done, (source, found) in enumerate(fetch.gather(tasks, deadline=RESOURCE_DEADLINE_SECONDS), start=1):
+        if source == "youtube":
+            for resource in found:
+                resources.append(resource)
+                if emit:
+                    emit(resource)
+        else:
+            pages.extend(found)
+        if progress:
+            progress(0.5 * done / len(tasks), f"Searched {source}")
+
+    tasks = [(result['link'], partial(site_resource, result)) for result in pages]
+    remaining = max(0.0, deadline - time.monotonic())
+    for done, (link, resource) in enumerate(fetch.gather(tasks, deadline=remaining), start=1):
+        resources.append(resource)
+        if emit:
+            emit(resource)
+        if progress:
+            progress(0.5 + 0.5 * done / len(tasks), f"Read {fetch.host_of(link)}")
+
+    quota_note = f"{quota_errors[0]}: {len(quota_errors)} source(s) were skipped." if quota_errors else None
+    return resources, quota_note
+
+def gather_resources_job(ctx, field: str) -> Tuple[List[Dict[str, str]], Optional[str]]:
+    return gather_resources(field, progress=ctx.report, emit=ctx.emit)
+
+def render_resource(resource: Dict[str, str]):
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.image(images.local_image(resource.get("thumbnail")), use_column_width=True)
+    with col2:
+        st.subheader(f"[{resource['title']}]({resource['link']})")
+        st.write(resource['content'])
+    st.markdown("---")
+
 def main():
     st.set_page_config(page_title="Advanced Exam Preparation System", layout="wide")
     
@@ -241,42 +444,71 @@ def main():
         
         if st.button("Generate Questions", key="generate_questions"):
             if topic:
-                with st.spinner("Generating questions..."):
-                    questions = generate_questions(topic, difficulty, num_questions, include_answers)
-                st.success("Questions generated successfully!")
-                st.markdown(questions)
+                # The question bank already serves repeats, and each click should draw a fresh sample
+                jobs.start("questions", "question_set", question_set_job, topic, difficulty, int(num_questions), include_answers, cache_ttl=0)
             else:
                 st.warning("Please enter a topic.")
+        
+        job = jobs.current("questions")
+        if job is not None:
+            if job.status == jobs.RUNNING:
+                st.progress(job.progress, text=f"Generating questions... {job.message}")
+                if st.button("Cancel", key="cancel_questions"):
+                    jobs.cancel("questions")
+                    st.experimental_rerun()
+                for question in list(job.partial):
+                    st.markdown(question)
+            elif job.status == jobs.DONE and job.result:
+                st.success("Questions generated successfully!")
+                st.markdown(job.result)
+            elif job.status == jobs.DONE:
+                st.warning("No questions could be generated. Please try again.")
+            elif job.status == jobs.FAILED:
+                st.error(f"Failed to generate questions: {job.error}")
+            elif job.status == jobs.CANCELLED:
+                st.info("Question generation was cancelled.")
+        elif jobs.cancelled("questions"):
+            st.info("Question generation was cancelled.")
     
     with tab2:
         st.header("Resource Explorer")
         selected_field = st.selectbox("Select a field to explore:", FIELDS)
         if st.button("Explore Resources", key="explore_resources"):
-            with st.spinner("Gathering resources..."):
-                resources = gather_resources(selected_field)
-            st.success(f"Found {len(resources)} resources!")
-            
-            for i, resource in enumerate(resources):
-                col1, col2 = st.columns([1, 3])
-                with col1:
-                    if "thumbnail" in resource:
-                        st.image(resource["thumbnail"], use_column_width=True)
-                    else:
-                        st.image("https://via.placeholder.com/150", use_column_width=True)
-                with col2:
-                    st.subheader(f"[{resource['title']}]({resource['link']})")
-                    st.write(resource['content'])
-                st.markdown("---")
+            jobs.start("resources", "gather_resources", gather_resources_job, selected_field)
+        
+        job = jobs.current("resources")
+        if job is not None:
+            if job.status == jobs.RUNNING:
+                st.progress(job.progress, text=f"Gathering resources... {job.message}")
+                if st.button("Cancel", key="cancel_resources"):
+                    jobs.cancel("resources")
+                    st.experimental_rerun()
+                for resource in list(job.partial):
+                    render_resource(resource)
+            elif job.status == jobs.DONE:
+                resources, quota_note = job.result
+                st.success(f"Found {len(resources)} resources!")
+                if quota_note:
+                    st.warning(quota_note)
+                
+                for resource in resources:
+                    render_resource(resource)
+            elif job.status == jobs.FAILED:
+                st.error(f"Failed to gather resources: {job.error}")
+            elif job.status == jobs.CANCELLED:
+                st.info("Resource search was cancelled.")
+        elif jobs.cancelled("resources"):
+            st.info("Resource search was cancelled.")
     
     with tab3:
         st.header("Academic Tutor")
         uploaded_files = st.file_uploader("Upload documents (PDF, TXT, MD, DOC, DOCX)", type=["pdf", "txt", "md", "doc", "docx"], accept_multiple_files=True)
         
         if uploaded_files:
-            qa_chain, graph = process_documents(uploaded_files)
+            qa_chain = process_documents(uploaded_files)
             st.success("Documents processed successfully!")
         else:
-            qa_chain, graph = None, None
+            qa_chain = None
         
         st.subheader("Chat with AI Tutor")
         if 'chat_history' not in st.session_state:
@@ -297,12 +529,17 @@ def main():
             with st.chat_message("assistant"):
                 if user_input.lower().startswith("search:"):
                     search_query = user_input[7:].strip()
-                    search_results = search_web(search_query, num_results=3)
-                    response = f"Here are some search results for '{search_query}':\n\n"
-                    for result in search_results:
-                        response += f"- [{result['title']}]({result['link']})\n  {result['snippet']}\n\n"
+                    try:
+                        search_results = search_web(search_query, num_results=3)
+                        response = f"Here are some search results for '{search_query}':\n\n"
+                        for result in search_results:
+                            response += f"- [{result['title']}]({result['link']})\n  {result['snippet']}\n\n"
+                    except quota.QuotaExceeded as e:
+                        response = f"{e}. Web search is unavailable until tomorrow."
                 else:
-                    response = chat([HumanMessage(content=user_input)]).content
+                    from langchain.schema import HumanMessage
+
+                    response = get_llm().invoke([HumanMessage(content=user_input)]).content
                 st.write(response)
                 st.session_state.chat_history.append(("assistant", response))
 
@@ -317,6 +554,9 @@ def main():
         </script>
         """
         st.components.v1.html(js)
+    
+    # Keep refreshing while questions or resources are still being generated in the background
+    jobs.poll_while_running("questions", "resources")
 
 if __name__ == "__main__":
     main()
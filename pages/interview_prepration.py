@@ -1,18 +1,10 @@
 import streamlit as st
 import random
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
 import os
 from dotenv import load_dotenv
-import base64
-import cv2
-import numpy as np
+from utils.models import get_face_cascade
 from PIL import Image
-import io
 import time
-import PyPDF2
-import docx
-import markdown
 
 # Load environment variables
 load_dotenv()
@@ -21,13 +13,17 @@ AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
 # Initialize the Falcon model
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    streaming=True,
-    timeout=60,
-)
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        streaming=True,
+        timeout=60,
+    )
 
 # Expanded list of roles
 roles = [
@@ -39,6 +35,8 @@ roles = [
 ]
 
 def generate_interview_questions(role):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_message = f"""You are an experienced interviewer for the role of {role}. 
     Generate 5 challenging and relevant interview questions for this position. 
     The questions should cover a range of skills and experiences required for the role."""
@@ -48,11 +46,13 @@ def generate_interview_questions(role):
         HumanMessage(content="Please provide 5 interview questions for this role.")
     ]
 
-    response = chat.invoke(messages).content
+    response = get_llm().invoke(messages).content
     questions = response.split('\n')
     return [q.strip() for q in questions if q.strip()]
 
 def get_interview_response(role, question, answer):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_message = f"""You are an experienced interviewer for the role of {role}. 
     Your task is to evaluate the candidate's response to the following question: '{question}'
     
@@ -76,15 +76,18 @@ def get_interview_response(role, question, answer):
         HumanMessage(content="Please provide your evaluation, feedback, follow-up question, and score.")
     ]
 
-    response = chat.invoke(messages).content
+    response = get_llm().invoke(messages).content
     return response
 
 def analyze_appearance(image):
+    import cv2
+    import numpy as np
+
     # Convert PIL Image to OpenCV format
     cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
     
-    # Load pre-trained face detection model
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    # Pre-trained face detection model, loaded once per process
+    face_cascade = get_face_cascade()
     
     # Convert to grayscale for face detection
     gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
@@ -130,6 +133,10 @@ def analyze_appearance(image):
     return "\n".join(analysis)
 
 def extract_text_from_file(file):
+    import docx
+    import markdown
+    import PyPDF2
+
     file_extension = file.name.split('.')[-1].lower()
     
     if file_extension == 'pdf':
@@ -151,6 +158,8 @@ def extract_text_from_file(file):
     return text
 
 def analyze_cv(cv_text):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_message = """You are an expert CV reviewer with extensive experience in various industries. 
     Analyze the given CV and provide:
     1. An overall assessment of the CV's strengths
@@ -165,7 +174,7 @@ def analyze_cv(cv_text):
         HumanMessage(content=f"Here's the text of the CV to review:\n\n{cv_text}\n\nPlease provide your analysis and suggestions.")
     ]
 
-    response = chat.invoke(messages).content
+    response = get_llm().invoke(messages).content
     return response
 
 def resize_image(image, max_size=800):
@@ -403,13 +412,15 @@ def main():
             - [Strategy 3]
             """
 
+            from langchain.schema import HumanMessage, SystemMessage
+
             messages = [
                 SystemMessage(content=overall_feedback_prompt),
                 HumanMessage(content="Please provide the overall feedback for the interview.")
             ]
 
             with st.spinner("Generating overall feedback..."):
-                overall_feedback = chat.invoke(messages).content
+                overall_feedback = get_llm().invoke(messages).content
 
             st.subheader("Overall Feedback")
             st.write(overall_feedback)
@@ -1,7 +1,9 @@
 import streamlit as st
-import googleapiclient.discovery
+import os
 from dotenv import load_dotenv
 from datetime import timedelta
+from functools import partial
+from utils import fetch, google_api, http_cache, images, quota, search_cache
 
 # Load environment variables
 load_dotenv()
@@ -10,35 +12,77 @@ load_dotenv()
 api_service_name = "youtube"
 api_version = "v3"
 DEVELOPER_KEY = os.getenv('DEVELOPER_KEY')
-youtube = googleapiclient.discovery.build(api_service_name, api_version, developerKey=DEVELOPER_KEY)
+# Most IDs videos.list accepts in one call
+VIDEOS_PER_REQUEST = 50
+# View counts drift, durations don't; a few hours' staleness is fine for either
+VIDEO_DETAILS_TTL_SECONDS = 6 * 3600
 
-def search_youtube(query, max_results=50):
-    try:
-        request = youtube.search().list(
-            q=query,
-            type="video",
-            part="id,snippet",
-            maxResults=max_results,
-            fields="items(id(videoId),snippet(title,description,thumbnails))"
-        )
-        response = request.execute()
-        return response.get('items', [])
-    except googleapiclient.errors.HttpError as e:
-        st.error(f"An error occurred: {e}")
-        return []
+# search.list and videos.list quota costs, and the most one lecture search may spend
+SEARCH_COST_UNITS = 100
+VIDEOS_COST_UNITS = 1
+QUOTA_CAP_UNITS = 800
+SEARCH_DEADLINE_SECONDS = 20
+# YouTube's videoDuration buckets and the longest video each holds (None: no limit)
+DURATION_BUCKETS = [("short", timedelta(minutes=4)), ("medium", timedelta(minutes=20)), ("long", None)]
+
+def search_youtube_page(query, video_duration="any", page_token=None, max_results=50, search_stats=None):
+    """One page of search results and the token for the next page (None on the last)."""
+    def call():
+        with google_api.service(api_service_name, api_version, DEVELOPER_KEY) as youtube:
+            request = youtube.search().list(
+                q=query,
+                type="video",
+                part="id,snippet",
+                maxResults=max_results,
+                videoDuration=video_duration,
+                pageToken=page_token,
+                fields="nextPageToken,items(id(videoId),snippet(title,description,thumbnails))"
+            )
+            response = request.execute()
+        return response.get('items', []), response.get('nextPageToken')
+
+    params = {"q": query, "videoDuration": video_duration, "pageToken": page_token, "maxResults": max_results}
+    (items, next_page_token), units = search_cache.cached_with_cost("youtube", params, call)
+    if search_stats is not None:
+        search_stats["quota_units"] = search_stats.get("quota_units", 0) + units
+    return items, next_page_token
+
+def get_videos_details(video_ids, search_stats=None):
+    """Duration and view count for each ID, from the cache or one videos.list call per 50 IDs."""
+    from googleapiclient.errors import HttpError
+
+    details = {}
+    missing = []
+    for video_id in video_ids:
+        cached = http_cache.get(f"yt-video:{video_id}")
+        if cached is not None:
+            details[video_id] = cached
+        else:
+            missing.append(video_id)
 
-def get_video_details(video_id):
     try:
-        request = youtube.videos().list(
-            part="contentDetails,statistics",
-            id=video_id,
-            fields="items(contentDetails(duration),statistics(viewCount))"
-        )
-        response = request.execute()
-        return response['items'][0] if response['items'] else None
-    except googleapiclient.errors.HttpError as e:
+        with google_api.service(api_service_name, api_version, DEVELOPER_KEY) as youtube:
+            for start in range(0, len(missing), VIDEOS_PER_REQUEST):
+                quota.charge("youtube", VIDEOS_COST_UNITS)
+                if search_stats is not None:
+                    search_stats["quota_units"] = search_stats.get("quota_units", 0) + VIDEOS_COST_UNITS
+                request = youtube.videos().list(
+                    part="contentDetails,statistics",
+                    id=",".join(missing[start:start + VIDEOS_PER_REQUEST]),
+                    fields="items(id,contentDetails(duration),statistics(viewCount))",
+                    maxResults=VIDEOS_PER_REQUEST
+                )
+                for item in request.execute().get('items', []):
+                    details[item['id']] = item
+                    http_cache.put(f"yt-video:{item['id']}", item, VIDEO_DETAILS_TTL_SECONDS)
+    except HttpError as e:
         st.error(f"An error occurred while fetching video details: {e}")
-        return None
+    except quota.QuotaExceeded as e:
+        st.warning(f"{e}; showing only videos with cached details.")
+    return details
+
+def get_video_details(video_id):
+    return get_videos_details([video_id]).get(video_id)
 
 def format_duration(duration):
     duration = duration.replace('PT', '')
@@ -64,6 +108,72 @@ def parse_duration(duration_str):
     else:
         return timedelta(seconds=int(parts[0]))
 
+def duration_buckets(min_duration):
+    """videoDuration buckets that can hold videos at least `min_duration` long."""
+    if min_duration == "Any":
+        return ["any"]
+    minimum = parse_duration(min_duration)
+    return [bucket for bucket, longest in DURATION_BUCKETS if longest is None or longest > minimum]
+
+def find_lectures(query, min_duration, wanted, search_stats):
+    """Yield (item, duration, views) for matching videos as they qualify.
+
+    Every duration bucket is paged through concurrently, a round at a time, until
+    `wanted` videos have qualified, the results run out, or QUOTA_CAP_UNITS is spent.
+    Quota spent and API errors are recorded in `search_stats`.
+    """
+    from googleapiclient.errors import HttpError
+
+    def fetch_page(bucket, page_token):
+        try:
+            return search_youtube_page(query, video_duration=bucket, page_token=page_token, search_stats=search_stats)
+        except (HttpError, quota.QuotaExceeded) as e:
+            search_stats["errors"].append(str(e))
+            return [], None
+
+    search_stats.setdefault("errors", [])
+    page_tokens = {bucket: None for bucket in duration_buckets(min_duration)}
+    search_stats.setdefault("quota_units", 0)
+    seen, found = set(), 0
+    # Cached pages cost nothing, so this only stops early when every page is a real call
+    while page_tokens and found < wanted and search_stats["quota_units"] + SEARCH_COST_UNITS * len(page_tokens) <= QUOTA_CAP_UNITS:
+        tasks = [(bucket, partial(fetch_page, bucket, token)) for bucket, token in page_tokens.items()]
+        items = []
+        for bucket, (page, next_token) in fetch.gather(tasks, deadline=SEARCH_DEADLINE_SECONDS):
+            items.extend(item for item in page if item['id']['videoId'] not in seen)
+            seen.update(item['id']['videoId'] for item in page)
+            if next_token:
+                page_tokens[bucket] = next_token
+            else:
+                del page_tokens[bucket]
+        if not items:
+            break
+
+        details = get_videos_details([item['id']['videoId'] for item in items], search_stats)
+        images.prefetch(item['snippet']['thumbnails']['medium']['url'] for item in items if item['id']['videoId'] in details)
+        for item in items:
+            video_details = details.get(item['id']['videoId'])
+            if not video_details:
+                continue
+            formatted_duration = format_duration(video_details['contentDetails']['duration'])
+            views = int(video_details['statistics'].get('viewCount', 0))
+            if min_duration == "Any" or parse_duration(formatted_duration) >= parse_duration(min_duration):
+                yield item, formatted_duration, views
+                found += 1
+                if found == wanted:
+                    return
+
+def render_lecture(item, duration, views):
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.image(images.local_image(item['snippet']['thumbnails']['medium']['url']), use_column_width=True)
+    with col2:
+        st.markdown(f"### [{item['snippet']['title']}](https://www.youtube.com/watch?v={item['id']['videoId']})")
+        st.markdown(f"**Duration:** {duration} | **Views:** {views:,}")
+        st.markdown(item['snippet']['description'])
+    
+    st.markdown("---")
+
 def main():
     st.set_page_config(page_title="S.H.E.R.L.O.C.K. Learning Assistant", page_icon="🕵️", layout="wide")
     st.sidebar.title("S.H.E.R.L.O.C.K.")
@@ -81,43 +191,30 @@ def main():
         index=0
     )
     
+    wanted = st.sidebar.number_input("Number of lectures", min_value=1, max_value=100, value=20)
+    
     search_button = st.sidebar.button("Search for Learning Resources")
     
     st.title("Learning Resources")
     
     if search_button and query:
-        with st.spinner("Searching for the best learning resources..."):
-            results = search_youtube(query)
-            
-        if results:
-            filtered_results = []
-            for item in results:
-                video_id = item['id']['videoId']
-                video_details = get_video_details(video_id)
-                
-                if video_details:
-                    duration = video_details['contentDetails']['duration']
-                    formatted_duration = format_duration(duration)
-                    views = int(video_details['statistics']['viewCount'])
-                    
-                    if min_duration == "Any" or parse_duration(formatted_duration) >= parse_duration(min_duration):
-                        filtered_results.append((item, formatted_duration, views))
-                
-            if filtered_results:
-                for item, duration, views in filtered_results:
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        st.image(item['snippet']['thumbnails']['medium']['url'], use_column_width=True)
-                    with col2:
-                        st.markdown(f"### [{item['snippet']['title']}](https://www.youtube.com/watch?v={item['id']['videoId']})")
-                        st.markdown(f"**Duration:** {duration} | **Views:** {views:,}")
-                        st.markdown(item['snippet']['description'])
-                    
-                    st.markdown("---")
-            else:
-                st.warning("No results found matching your duration criteria. Try adjusting the minimum duration or search query.")
+        status = st.empty()
+        status.info("Searching for the best learning resources...")
+        search_stats = {}
+        found = 0
+        for lecture in find_lectures(query, min_duration, int(wanted), search_stats):
+            render_lecture(*lecture)
+            found += 1
+            status.info(f"Found {found} of {int(wanted)} lectures, still searching...")
+        
+        for error in search_stats["errors"]:
+            st.error(f"An error occurred: {error}")
+        if found:
+            status.success(f"Found {found} lectures using about {search_stats['quota_units']} API quota units.")
+        elif min_duration != "Any":
+            status.warning("No results found matching your duration criteria. Try adjusting the minimum duration or search query.")
         else:
-            st.warning("No results found. Please try a different search query.")
+            status.warning("No results found. Please try a different search query.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,22 +1,13 @@
 import streamlit as st
-import random
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.document_loaders import TextLoader, UnstructuredFileLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
 import os
 from dotenv import load_dotenv
+from utils.models import MINI_EMBEDDING_MODEL, get_embeddings
 import json
 from tenacity import retry, stop_after_attempt, wait_fixed
 from streamlit_chat import message
-from gtts import gTTS
 import io
-from PyPDF2 import PdfReader
-import docx2txt
 import logging
-import tempfile
+from utils import jobs, session_memory
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,17 +19,23 @@ AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
 # Initialize the models
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    streaming=True,
-)
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
 
-# Use SentenceTransformers for embeddings
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        streaming=True,
+    )
 
 def process_document(file):
+    import docx2txt
+    from PyPDF2 import PdfReader
+    from utils.text_splitter import get_text_splitter
+    from utils.vector_index import build_vectorstore_from_texts
+
     content = ""
     file_extension = file.name.split('.')[-1].lower()
 
@@ -62,19 +59,21 @@ def process_document(file):
         st.warning("The uploaded file appears to be empty or unreadable. Please check the file and try again.")
         return None
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter(chunk_size=192, chunk_overlap=32, tokenizer_name=MINI_EMBEDDING_MODEL)
     chunks = text_splitter.split_text(content)
     
     if not chunks:
         st.warning("Unable to extract meaningful content from the file. Please try a different file.")
         return None
 
-    vectorstore = FAISS.from_texts(chunks, embeddings)
+    vectorstore = build_vectorstore_from_texts(chunks, get_embeddings(MINI_EMBEDDING_MODEL))
     
     return vectorstore, content
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 def generate_mind_palace(topic, learning_style, user_preferences, content=None):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_message = f"""
     You are an expert in creating memorable and personalized mind palaces to aid in learning and retention. 
     The user wants to learn about '{topic}' and their preferred learning style is '{learning_style}'.
@@ -120,16 +119,18 @@ def generate_mind_palace(topic, learning_style, user_preferences, content=None):
         messages.append(HumanMessage(content=f"Use this additional context to enhance the mind palace, focusing on the most important and memorable aspects: {content[:2000]}"))
     
     try:
-        response = chat.invoke(messages)
+        response = get_llm().invoke(messages)
         json_response = json.loads(response.content)
         return json_response
     except json.JSONDecodeError as e:
-        st.error(f"Error decoding JSON response: {str(e)}")
-        st.error("Raw response content:")
-        st.error(response.content)
+        # Runs in a background job, so log instead of writing to the page
+        logger.error(f"Error decoding JSON response: {str(e)}")
+        logger.error(f"Raw response content: {response.content}")
         raise
 
 def generate_audio_description(mind_palace_data):
+    from gtts import gTTS
+
     description = f"Welcome to your personalized and memorable mind palace: {mind_palace_data['palace_name']}. Let's take a journey through your palace, using vivid imagery and your preferred learning style to make it unforgettable. "
     for room in mind_palace_data['rooms']:
         description += f"We're entering the {room['name']}. {room['description']} "
@@ -145,6 +146,13 @@ def generate_audio_description(mind_palace_data):
     
     return fp
 
+def mind_palace_job(ctx, topic, learning_style, user_preferences, content=None):
+    ctx.report(0.1, "Crafting your unforgettable mind palace...")
+    mind_palace_data = generate_mind_palace(topic, learning_style, user_preferences, content)
+    ctx.report(0.7, "Creating a vivid audio guide for your mind palace...")
+    audio = generate_audio_description(mind_palace_data).getvalue()
+    return mind_palace_data, audio
+
 def main():
     st.set_page_config(page_title="S.H.E.R.L.O.C.K. Memorable Mind Palace Generator", layout="wide")
     
@@ -230,35 +238,40 @@ def main():
     user_preferences = st.text_area("Enter your personal preferences (e.g., favorite places, hobbies, movies, or anything that resonates with you):")
     
     if st.button("Generate Memorable Mind Palace"):
-        with st.spinner("Crafting your unforgettable mind palace..."):
-            content = None
-            if uploaded_file is not None:
-                vectorstore, content = process_document(uploaded_file)
-                if vectorstore is None:
-                    st.error("Failed to process the uploaded document. Please try again with a different file.")
-                    return
-                topic = "Document Content"
-            elif topic is None or topic.strip() == "":
-                st.error("Please enter a topic or upload a document.")
+        content = None
+        if uploaded_file is not None:
+            vectorstore, content = process_document(uploaded_file)
+            if vectorstore is None:
+                st.error("Failed to process the uploaded document. Please try again with a different file.")
                 return
-            
-            try:
-                mind_palace_data = generate_mind_palace(topic, learning_style, user_preferences, content)
-                if mind_palace_data is None:
-                    st.error("Failed to generate the mind palace. Please try again.")
-                    return
-                
+            topic = "Document Content"
+        elif topic is None or topic.strip() == "":
+            st.error("Please enter a topic or upload a document.")
+            return
+        
+        jobs.start("mind_palace", "mind_palace", mind_palace_job, topic, learning_style, user_preferences, content)
+    
+    job = jobs.current("mind_palace")
+    if job is not None:
+        if job.status == jobs.RUNNING:
+            st.progress(job.progress, text=job.message)
+            if st.button("Cancel"):
+                jobs.cancel("mind_palace")
+                st.experimental_rerun()
+        else:
+            jobs.clear("mind_palace")
+            if job.status == jobs.DONE:
+                mind_palace_data, audio = job.result
                 st.session_state.mind_palace = mind_palace_data
                 st.session_state.chat_history = []
-                
-                # Generate audio description with selected voice
-                with st.spinner("Creating a vivid audio guide for your mind palace..."):
-                    audio_fp = generate_audio_description(mind_palace_data)
-                    st.session_state.mind_palace_audio = audio_fp
-            except Exception as e:
-                logger.error(f"An error occurred while generating the mind palace: {str(e)}")
+                session_memory.put("mind_palace_audio", audio)
+            elif job.status == jobs.FAILED:
+                logger.error(f"An error occurred while generating the mind palace: {str(job.error)}")
                 st.error(f"An error occurred while generating the mind palace. Please try again.")
-                return
+            elif job.status == jobs.CANCELLED:
+                st.info("Mind palace generation was cancelled.")
+    elif jobs.cancelled("mind_palace"):
+        st.info("Mind palace generation was cancelled.")
 
     if 'mind_palace' in st.session_state:
         mind_palace_data = st.session_state.mind_palace
@@ -266,9 +279,10 @@ def main():
         st.subheader(f"Your Memorable Mind Palace: {mind_palace_data['palace_name']}")
         
         # Audio player
-        if 'mind_palace_audio' in st.session_state:
+        audio = session_memory.get("mind_palace_audio")
+        if audio is not None:
             try:
-                st.audio(st.session_state.mind_palace_audio, format='audio/wav')
+                st.audio(audio, format='audio/wav')
                 st.write("👆 Listen to the vivid audio guide and imagine your mind palace. Close your eyes and immerse yourself in this mental journey.")
             except Exception as e:
                 logger.error(f"Error playing audio: {str(e)}")
@@ -323,7 +337,9 @@ def main():
                 {context}
                 """
                 
-                response = chat.invoke([
+                from langchain.schema import HumanMessage, SystemMessage
+
+                response = get_llm().invoke([
                     SystemMessage(content=system_message),
                     HumanMessage(content=user_input)
                 ])
@@ -337,5 +353,7 @@ def main():
             # Force a rerun to update the chat history display and reset the input
             st.experimental_rerun()
 
+    jobs.poll_while_running("mind_palace")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,8 @@
 import streamlit as st
-import random
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader, UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 import os
 from dotenv import load_dotenv
+from utils.models import get_embeddings
 import tempfile
-from PIL import Image
-import io
 
 # Load environment variables
 load_dotenv()
@@ -20,17 +11,23 @@ AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
 # Initialize the Falcon model
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    streaming=True,
-)
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
 
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings()
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        streaming=True,
+    )
 
 def process_documents(uploaded_files):
+    from langchain.chains import RetrievalQA
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader, UnstructuredWordDocumentLoader
+    from utils.hybrid_retriever import build_hybrid_retriever
+    from utils.text_splitter import get_text_splitter
+
     documents = []
     for uploaded_file in uploaded_files:
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
@@ -53,14 +50,13 @@ def process_documents(uploaded_files):
         documents.extend(loader.load())
         os.unlink(temp_file_path)
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter()
     texts = text_splitter.split_documents(documents)
     
-    vectorstore = FAISS.from_documents(texts, embeddings)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    retriever = build_hybrid_retriever(texts, get_embeddings(), k=5)
     
     qa_chain = RetrievalQA.from_chain_type(
-        llm=chat,
+        llm=get_llm(),
         chain_type="stuff",
         retriever=retriever,
         return_source_documents=True
@@ -69,23 +65,27 @@ def process_documents(uploaded_files):
     return qa_chain
 
 def generate_mnemonic(topic, user_preferences):
+    from langchain.schema import HumanMessage
+
     prompt = f"""
     Generate a memorable mnemonic for the topic: {topic}.
     Consider the user's preferences: {user_preferences}.
     The mnemonic should be easy to remember and relate to the topic.
     Also provide a brief explanation of how the mnemonic relates to the topic.
     """
-    response = chat.invoke([HumanMessage(content=prompt)])
+    response = get_llm().invoke([HumanMessage(content=prompt)])
     return response.content
 
 def generate_quiz_question(mnemonic):
+    from langchain.schema import HumanMessage
+
     quiz_prompt = f"""
     Create a quiz question based on the mnemonic: {mnemonic}
     Format your response as follows:
     Question: [Your question here]
     Answer: [Your answer here]
     """
-    quiz_response = chat.invoke([HumanMessage(content=quiz_prompt)])
+    quiz_response = get_llm().invoke([HumanMessage(content=quiz_prompt)])
     content = quiz_response.content.strip()
     
     try:
@@ -99,11 +99,13 @@ def generate_quiz_question(mnemonic):
     return question, answer
 
 def generate_image_prompt(mnemonic):
+    from langchain.schema import HumanMessage
+
     prompt = f"""
     Create a detailed image prompt for Midjourney based on the mnemonic: {mnemonic}
     The image should visually represent the key elements of the mnemonic.
     """
-    response = chat.invoke([HumanMessage(content=prompt)])
+    response = get_llm().invoke([HumanMessage(content=prompt)])
     return response.content
 
 def main():
@@ -224,7 +226,9 @@ def main():
                 {st.session_state.generated_mnemonic}
                 Describe the layout, key elements, and their relationships.
                 """
-                visualization_description = chat.invoke([HumanMessage(content=visualization_prompt)]).content
+                from langchain.schema import HumanMessage
+
+                visualization_description = get_llm().invoke([HumanMessage(content=visualization_prompt)]).content
                 st.write(visualization_description)
                 st.info("You can use this description to create a visual representation of your mnemonic using tools like Canva or Mindmeister.")
 
@@ -1,17 +1,12 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from langchain_community.chat_models import ChatOpenAI
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader, Docx2txtLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
+from utils.models import get_embeddings
 import tempfile
 from typing import List, Dict
 import json
 from datetime import datetime
+from utils import session_memory
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +17,8 @@ AI71_API_KEY = os.getenv('AI71_API_KEY')
 # Initialize the Falcon model
 @st.cache_resource
 def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
     return ChatOpenAI(
         model="tiiuae/falcon-180B-chat",
         api_key=AI71_API_KEY,
@@ -29,12 +26,11 @@ def get_llm():
         streaming=True,
     )
 
-# Initialize embeddings
-@st.cache_resource
-def get_embeddings():
-    return HuggingFaceEmbeddings()
-
 def process_document(file_content, file_type):
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader, Docx2txtLoader
+    from utils.hybrid_retriever import build_hybrid_retriever
+    from utils.text_splitter import get_text_splitter
+
     with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}') as tmp_file:
         if isinstance(file_content, str):
             tmp_file.write(file_content.encode('utf-8'))
@@ -54,16 +50,18 @@ def process_document(file_content, file_type):
         raise ValueError(f"Unsupported file type: {file_type}")
 
     documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter()
     texts = text_splitter.split_documents(documents)
     
-    vectorstore = FAISS.from_documents(texts, get_embeddings())
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    retriever = build_hybrid_retriever(texts, get_embeddings(), k=5)
     
     os.unlink(tmp_file_path)
     return retriever
 
 def generate_notes(retriever, topic, style, length):
+    from langchain.chains import RetrievalQA
+    from langchain.prompts import PromptTemplate
+
     prompt_template = f"""
     You are an expert note-taker and summarizer. Your task is to create {style} and {length} notes on the given topic.
     Use the following guidelines:
@@ -151,14 +149,14 @@ def main():
             
             with st.spinner("Processing document..."):
                 retriever = process_document(file_content, file_type)
-                st.session_state.retriever = retriever
+                session_memory.put("retriever", retriever)
             st.success("Document processed!")
     elif input_method == "Enter Text":
         text_input = st.text_area("Enter your text here:", height=200)
         if text_input:
             with st.spinner("Processing text..."):
                 retriever = process_document(text_input, 'txt')
-                st.session_state.retriever = retriever
+                session_memory.put("retriever", retriever)
             st.success("Text processed!")
 
     topic = st.text_input("Enter the topic for note generation:")
@@ -170,10 +168,11 @@ def main():
         length = st.selectbox("Note Length", ["Short", "Medium", "Long"])
 
     if st.button("Generate Notes"):
-        if topic and hasattr(st.session_state, 'retriever'):
+        retriever = session_memory.get("retriever")
+        if topic and retriever is not None:
             with st.spinner("Generating notes..."):
                 try:
-                    notes = generate_notes(st.session_state.retriever, topic, style, length)
+                    notes = generate_notes(retriever, topic, style, length)
                     st.subheader("Generated Notes:")
                     st.markdown(notes)
                     
@@ -1,39 +1,123 @@
 import streamlit as st
-import requests
 from datetime import datetime, timedelta
-import pandas as pd
 from dotenv import load_dotenv
 import os
+import re
+from functools import partial
+from utils import fetch, paper_store, quota, search_cache
 
 # Load environment variables
 load_dotenv()
 
 # Scopus API key
 SCOPUS_API_KEY = os.getenv('SCOPUS_API_KEY')
+SCOPUS_SEARCH_URL = "https://api.elsevier.com/content/search/scopus"
+# Scopus returns at most this many entries per request, whatever `count` asks for
+SCOPUS_PAGE_SIZE = 25
+SCOPUS_PAGES_DEADLINE_SECONDS = 30
+# Columns shown in the results table; the rest appear in a paper's details
+TABLE_COLUMNS = ["Title", "Authors", "Year", "Journal", "Citations"]
+SORT_ORDERS = {
+    "Most cited": ("Citations", False),
+    "Newest": ("Year", False),
+    "Oldest": ("Year", True),
+    "Title": ("Title", True),
+}
+PAGE_SIZES = [10, 25, 50, 100]
 
-def search_scopus(query, start_year, end_year, max_results=50):
-    base_url = "https://api.elsevier.com/content/search/scopus"
-    
-    params = {
-        "query": query,
-        "date": f"{start_year}-{end_year}",
-        "count": max_results,
-        "sort": "citedby-count desc",
-        "field": "title,author,year,publicationName,description,citedby-count,doi,eid"
-    }
-    
-    headers = {
-        "X-ELS-APIKey": SCOPUS_API_KEY,
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.get(base_url, params=params, headers=headers)
+AI71_BASE_URL = "https://api.ai71.ai/v1/"
+AI71_API_KEY = os.getenv('AI71_API_KEY')
+# Papers, most cited first, that a digest covers
+DIGEST_TOP_N = 20
+# Falcon-180B's context holds the prompt and the reply together
+LLM_CONTEXT_TOKENS = 2048
+# Counts come from the embedding tokenizer, which Falcon's can exceed by a
+# fair margin on the same text, so only this fraction of the context is planned
+DIGEST_CONTEXT_SHARE = 0.8
+DIGEST_INSTRUCTION_TOKENS = 80
+# Room reserved for each paper's line of summary
+DIGEST_REPLY_TOKENS = 60
+DIGEST_ABSTRACT_TOKENS = 300
+DIGEST_PAPERS_PER_BATCH = 8
+DIGEST_DEADLINE_SECONDS = 90
+# "[3] ...", though some replies number their lines "3." or "3)" instead
+DIGEST_LINE = re.compile(r"^\s*\[?(\d+)[\].):]\s*(.+)$", re.M)
+
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+    )
+
+@st.cache_resource
+def get_scopus_session():
+    """Session whose pooled keep-alive connections are shared by the concurrent page requests."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=fetch.PER_HOST_LIMIT, max_retries=retry))
+    session.headers.update({"X-ELS-APIKey": SCOPUS_API_KEY, "Accept": "application/json"})
+    return session
+
+def fetch_scopus_page(query, start_year, end_year, start, count=SCOPUS_PAGE_SIZE):
+    """One page of results as {"entries": [...], "total": total results for the query}."""
+    def call():
+        params = {
+            "query": query,
+            "date": f"{start_year}-{end_year}",
+            "start": start,
+            "count": count,
+            "sort": "citedby-count desc",
+            "field": "title,author,year,publicationName,description,citedby-count,doi,eid"
+        }
+        with fetch.host_slot(SCOPUS_SEARCH_URL):
+            response = get_scopus_session().get(SCOPUS_SEARCH_URL, params=params, timeout=30)
         response.raise_for_status()
-        return response.json()["search-results"]["entry"]
-    except requests.exceptions.RequestException as e:
-        st.error(f"An error occurred while searching Scopus: {e}")
-        return []
+        results = response.json()["search-results"]
+        return {
+            # An empty result set comes back as a single entry holding an error message
+            "entries": [entry for entry in results.get("entry", []) if "error" not in entry],
+            "total": int(results.get("opensearch:totalResults", 0)),
+        }
+
+    params = {"query": query, "start_year": start_year, "end_year": end_year, "start": start, "count": count}
+    return search_cache.cached("scopus", params, call)
+
+def search_scopus_pages(query, start_year, end_year, max_results=50, search_stats=None):
+    """Yield lists of results in rank order: the first page at once, the rest as they arrive.
+
+    Later pages are requested concurrently once the first reports how many
+    results there are; a page that fails is skipped and noted in `search_stats`.
+    """
+    first = fetch_scopus_page(query, start_year, end_year, 0, min(SCOPUS_PAGE_SIZE, max_results))
+    yield first["entries"]
+
+    wanted = min(max_results, first["total"])
+    if search_stats is not None:
+        search_stats["total"] = first["total"]
+    tasks = [
+        (start, partial(fetch_scopus_page, query, start_year, end_year, start, min(SCOPUS_PAGE_SIZE, wanted - start)))
+        for start in range(SCOPUS_PAGE_SIZE, wanted, SCOPUS_PAGE_SIZE)
+    ]
+    pages, next_start, received = {}, SCOPUS_PAGE_SIZE, 0
+    for start, page in fetch.gather(tasks, deadline=SCOPUS_PAGES_DEADLINE_SECONDS):
+        received += 1
+        pages[start] = page["entries"]
+        while next_start in pages:
+            yield pages.pop(next_start)
+            next_start += SCOPUS_PAGE_SIZE
+    # Pages after one that failed or timed out are still shown, in order
+    for start in sorted(pages):
+        yield pages[start]
+    if search_stats is not None:
+        search_stats["missing_pages"] = len(tasks) - received
 
 def format_authors(author_info):
     if isinstance(author_info, list):
@@ -60,6 +144,197 @@ def get_paper_link(paper):
         return f"https://www.scopus.com/record/display.uri?eid={eid}&origin=resultslist"
     return "#"
 
+def paper_row(paper):
+    return {
+        "Title": safe_get(paper, ["dc:title"]),
+        "Authors": format_authors(safe_get(paper, ["author"])),
+        "Year": safe_get(paper, ["prism:coverDate"])[:4],
+        "Journal": safe_get(paper, ["prism:publicationName"]),
+        "Abstract": safe_get(paper, ["dc:description"]),
+        "Citations": safe_get(paper, ["citedby-count"], "0"),
+        "DOI": safe_get(paper, ["prism:doi"]),
+        "Link": get_paper_link(paper)
+    }
+
+def render_paper(paper):
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.markdown(f"#### [{paper['Title']}]({paper['Link']})")
+        st.markdown(f"**Authors:** {paper['Authors']}")
+        st.markdown(f"**Published in:** {paper['Journal']} ({paper['Year']})")
+        st.markdown(f"**Abstract:** {paper['Abstract']}")
+    with col2:
+        st.metric("Citations", paper["Citations"])
+
+def results_frame(rows):
+    """Rows from paper_row as a DataFrame with numeric Year and Citations, for filtering and sorting."""
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    df["Year"] = pd.to_numeric(df["Year"], errors="coerce").astype("Int64")
+    df["Citations"] = pd.to_numeric(df["Citations"], errors="coerce").fillna(0).astype(int)
+    return df
+
+def same_query(a, b):
+    return " ".join(a.lower().split()) == " ".join(b.lower().split())
+
+def results_cover(results, query, start_year, end_year, max_results):
+    """Whether the loaded results can answer this search without going back to Scopus.
+
+    They can when the query is the same, the year range lies inside the one
+    that was fetched, and either enough papers fall in it or everything the
+    query matched was already loaded.
+    """
+    df = results["frame"]
+    if df is None or not same_query(results["query"], query):
+        return False
+    if start_year < results["start_year"] or end_year > results["end_year"]:
+        return False
+    exhaustive = results["total"] is not None and len(df) >= results["total"]
+    return exhaustive or int(df["Year"].between(start_year, end_year).fillna(False).sum()) >= max_results
+
+def refine_results(df, start_year, end_year, max_results):
+    """The most cited `max_results` papers of `df` published between the two years."""
+    in_range = df["Year"].between(start_year, end_year).fillna(False).astype(bool)
+    return df[in_range].sort_values("Citations", ascending=False, kind="stable").head(max_results)
+
+def render_results(df, query):
+    """One table for the whole result set, filtered, sorted and paged on the server.
+
+    However many papers there are, a rerun draws the same few elements: the
+    filters, one page of the table, and the details of a single paper.
+    """
+    filters = st.columns(4)
+    author = filters[0].text_input("Author", key="results_author")
+    min_citations = filters[1].number_input("Minimum citations", min_value=0, value=0, step=10, key="results_citations")
+    journal_options = sorted(df["Journal"].unique())
+    # A narrower year range can drop journals picked earlier
+    st.session_state["results_journals"] = [
+        journal for journal in st.session_state.get("results_journals", []) if journal in journal_options
+    ]
+    journals = filters[2].multiselect("Journal", journal_options, key="results_journals")
+    sort_order = filters[3].selectbox("Sort by", list(SORT_ORDERS), key="results_sort")
+
+    mask = df["Citations"] >= min_citations
+    if author.strip():
+        mask &= df["Authors"].str.contains(author.strip(), case=False, regex=False)
+    if journals:
+        mask &= df["Journal"].isin(journals)
+    column, ascending = SORT_ORDERS[sort_order]
+    view = df[mask].sort_values(column, ascending=ascending, na_position="last", kind="stable")
+
+    if view.empty:
+        st.info("No papers match these filters.")
+        return
+    controls = st.columns([1, 1, 4])
+    page_size = controls[0].selectbox("Per page", PAGE_SIZES, index=1, key="results_page_size")
+    pages = (len(view) + page_size - 1) // page_size
+    # Narrower filters can leave the chosen page past the end. The page number
+    # lives only in session state, so the widget is given no default value
+    if st.session_state.setdefault("results_page", 1) > pages:
+        st.session_state["results_page"] = pages
+    page = controls[1].number_input("Page", min_value=1, max_value=pages, step=1, key="results_page") if pages > 1 else 1
+    controls[2].caption(f"Showing {len(view)} of {len(df)} papers on '{query}'")
+    page_view = view.iloc[(page - 1) * page_size:page * page_size]
+    st.dataframe(page_view[TABLE_COLUMNS], use_container_width=True)
+
+    selected = st.selectbox("Paper details", [None] + list(page_view.index), key="results_details",
+                            format_func=lambda i: "Select a paper..." if i is None else df.at[i, "Title"])
+    if selected is not None:
+        render_paper(df.loc[selected])
+
+def render_related(related, query):
+    if related is None:
+        return
+    with st.expander(f"Related papers from earlier searches ({len(related)})"):
+        st.caption(f"Stored papers whose text resembles '{query}'. Scopus did not return them for this search, "
+                   "so they are not counted among its results or included in the CSV.")
+        st.dataframe(related[TABLE_COLUMNS], use_container_width=True)
+
+def clip_to_tokens(text, max_tokens):
+    """`text` cut after `max_tokens` tokens, and its length in tokens."""
+    from utils.text_splitter import get_tokenizer, token_offsets
+
+    _, ends = token_offsets(text, get_tokenizer())
+    if len(ends) <= max_tokens:
+        return text, len(ends)
+    return text[:ends[max_tokens - 1]] + "...", max_tokens
+
+def digest_input_budget(papers):
+    """Tokens of abstracts a batch of `papers` papers can carry and still fit its replies."""
+    usable = int(LLM_CONTEXT_TOKENS * DIGEST_CONTEXT_SHARE)
+    return usable - DIGEST_INSTRUCTION_TOKENS - DIGEST_REPLY_TOKENS * papers
+
+def digest_batches(papers):
+    """Pack (doi, title, abstract) triples into batches whose prompt and replies fit the context."""
+    batches, batch, used = [], [], 0
+    for doi, title, abstract in papers:
+        text, tokens = clip_to_tokens(f"{title}\n{abstract}", DIGEST_ABSTRACT_TOKENS)
+        full = len(batch) == DIGEST_PAPERS_PER_BATCH
+        if batch and (full or used + tokens > digest_input_budget(len(batch) + 1)):
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append((doi, text))
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def summarize_batch(batch):
+    """{doi: digest} for one batch of papers, from a single LLM call."""
+    from langchain.schema import HumanMessage
+
+    listing = "\n\n".join(f"[{i}] {text}" for i, (_, text) in enumerate(batch, start=1))
+    prompt = (
+        "Summarize each of the following research papers in one or two plain sentences: "
+        "what it studies and what it finds. Answer with exactly one line per paper, "
+        "starting with its number in brackets, like \"[1] ...\".\n\n" + listing
+    )
+    with fetch.host_slot(AI71_BASE_URL):
+        reply = get_llm().bind(max_tokens=DIGEST_REPLY_TOKENS * len(batch)).invoke([HumanMessage(content=prompt)]).content
+    digests = {}
+    for match in DIGEST_LINE.finditer(reply):
+        number = int(match.group(1))
+        if 1 <= number <= len(batch):
+            digests[batch[number - 1][0]] = match.group(2).strip()
+    return digests
+
+def digest_papers(df, progress=None):
+    """{doi: digest} for the papers in `df` that have a DOI and an abstract.
+
+    Digests already stored are reused, whoever asked for them; the rest are
+    summarized in token-budgeted batches, one LLM call per batch, in parallel.
+    """
+    papers = df[(df["DOI"] != "N/A") & (df["Abstract"] != "N/A")]
+    digests = paper_store.digests(list(papers["DOI"]))
+    missing = papers[~papers["DOI"].isin(list(digests))]
+    batches = digest_batches(zip(missing["DOI"], missing["Title"], missing["Abstract"]))
+    tasks = [(i, partial(summarize_batch, batch)) for i, batch in enumerate(batches)]
+    for done, (_, batch_digests) in enumerate(fetch.gather(tasks, deadline=DIGEST_DEADLINE_SECONDS), start=1):
+        paper_store.save_digests(batch_digests)
+        digests.update(batch_digests)
+        if progress:
+            progress(done / len(tasks), f"Summarized {done} of {len(tasks)} batches")
+    return digests
+
+def render_digest(df, generate):
+    """Digest of the most cited papers in `df`; only asks the LLM for missing ones when `generate` is set."""
+    top = df.head(DIGEST_TOP_N)
+    if generate:
+        bar = st.progress(0.0)
+        digests = digest_papers(top, progress=lambda fraction, text: bar.progress(fraction, text=text))
+        bar.empty()
+    else:
+        digests = paper_store.digests([doi for doi in top["DOI"] if doi != "N/A"])
+    lines = [
+        f"- **[{row.Title}]({row.Link})** ({row.Year}): {digests[row.DOI]}"
+        for row in top.itertuples() if row.DOI in digests
+    ]
+    if lines:
+        st.markdown("\n".join(lines))
+    if len(lines) < len(top):
+        st.caption(f"{len(top) - len(lines)} paper(s) without a DOI, an abstract or a usable summary are left out.")
+
 def main():
     st.set_page_config(page_title="S.H.E.R.L.O.C.K. Research Assistant", page_icon="🔬", layout="wide")
     
@@ -86,50 +361,122 @@ def main():
     
     st.title("Research Papers and Articles")
     
-    if search_button and query:
-        with st.spinner("Searching for the most relevant research papers..."):
-            results = search_scopus(query, start_year, end_year, max_results)
-        
-        if results:
-            papers = []
-            for paper in results:
-                papers.append({
-                    "Title": safe_get(paper, ["dc:title"]),
-                    "Authors": format_authors(safe_get(paper, ["author"])),
-                    "Year": safe_get(paper, ["prism:coverDate"])[:4],
-                    "Journal": safe_get(paper, ["prism:publicationName"]),
-                    "Abstract": safe_get(paper, ["dc:description"]),
-                    "Citations": safe_get(paper, ["citedby-count"], "0"),
-                    "Link": get_paper_link(paper)
-                })
-            
-            df = pd.DataFrame(papers)
-            
-            st.markdown(f"### Found {len(results)} papers on '{query}'")
-            
-            for _, paper in df.iterrows():
-                with st.container():
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.markdown(f"#### [{paper['Title']}]({paper['Link']})")
-                        st.markdown(f"**Authors:** {paper['Authors']}")
-                        st.markdown(f"**Published in:** {paper['Journal']} ({paper['Year']})")
-                        st.markdown(f"**Abstract:** {paper['Abstract']}")
-                    with col2:
-                        st.metric("Citations", paper["Citations"])
-                    
-                    st.markdown("---")
-            
-            # Download results as CSV
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="Download results as CSV",
-                data=csv,
-                file_name=f"{query.replace(' ', '_')}_research_papers.csv",
-                mime="text/csv",
-            )
+    results = st.session_state.get("research_results")
+    refine_locally = results is not None and results_cover(results, query, start_year, end_year, max_results)
+    if search_button and query and not refine_locally:
+        import requests
+
+        header = st.empty()
+        header.info("Searching for the most relevant research papers...")
+        # Results stream into a single table element, redrawn once per page
+        table = st.empty()
+        papers = []
+        search_stats = {}
+        matches, related, complete = paper_store.search(query, start_year, end_year, max_results)
+        papers.extend(paper_row(paper) for paper in matches)
+        if papers:
+            table.dataframe(results_frame(papers)[TABLE_COLUMNS], use_container_width=True)
+        if complete:
+            search_stats["offline"] = True
         else:
-            st.warning("No results found. Please try a different search query or adjust the year range.")
+            # Stored results of an earlier identical search are only a preview:
+            # Scopus is still asked for the full result count, and what it returns replaces them
+            if matches:
+                header.info(f"Found {len(papers)} stored papers on '{query}', searching Scopus for more...")
+            shown = {paper_store.paper_key(paper) for paper in matches}
+            fetched = []
+            try:
+                pages = search_scopus_pages(query, start_year, end_year, max_results, search_stats)
+                for page in pages:
+                    fetched.extend(page)
+                    for paper in page:
+                        key = paper_store.paper_key(paper)
+                        if key is not None and key in shown:
+                            continue
+                        shown.add(key)
+                        papers.append(paper_row(paper))
+                    if papers:
+                        table.dataframe(results_frame(papers)[TABLE_COLUMNS], use_container_width=True)
+                    header.info(f"Loaded {len(fetched)} papers on '{query}' from Scopus, fetching more...")
+            except requests.exceptions.RequestException as e:
+                st.error(f"An error occurred while searching Scopus: {e}")
+            except quota.QuotaExceeded as e:
+                st.warning(f"{e}. Please try again tomorrow.")
+            if fetched:
+                paper_store.upsert(fetched)
+                if not search_stats.get("missing_pages"):
+                    paper_store.record_query(query, start_year, end_year, fetched, search_stats["total"])
+                matches = fetched[:max_results]
+                papers = [paper_row(paper) for paper in matches]
+        result_keys = {paper_store.paper_key(paper) for paper in matches}
+        related = [paper_row(paper) for paper in related if paper_store.paper_key(paper) not in result_keys]
+
+        header.empty()
+        table.empty()
+        # Filters and paging from the previous result set don't apply to this one
+        for key in [key for key in st.session_state if key.startswith("results_")]:
+            del st.session_state[key]
+        results = st.session_state["research_results"] = {
+            "query": query,
+            "start_year": start_year,
+            "end_year": end_year,
+            "frame": results_frame(papers) if papers else None,
+            # Shown apart from the results; they are not in the table, the CSV or results_cover
+            "related": results_frame(related) if related else None,
+            "total": search_stats.get("total"),
+            "stats": search_stats,
+        }
+        refine_locally = True
+
+    # The broadest result set fetched so far stays in the session; narrower
+    # year ranges, smaller result counts and the table filters are applied to it
+    if results is None:
+        return
+    search_stats = results["stats"]
+    if results["frame"] is None:
+        st.warning("No results found. Please try a different search query or adjust the year range.")
+        render_related(results["related"], results["query"])
+        return
+    if refine_locally:
+        df = refine_results(results["frame"], start_year, end_year, max_results)
+    elif same_query(results["query"], query):
+        # Show what overlaps the loaded range until the user searches again
+        overlap = (max(start_year, results["start_year"]), min(end_year, results["end_year"]))
+        df = refine_results(results["frame"], *overlap, max_results)
+        st.info("These settings reach beyond the papers already loaded. Search again to fetch the rest from Scopus.")
+    else:
+        df = refine_results(results["frame"], results["start_year"], results["end_year"], max_results)
+    query = results["query"]
+    if df.empty:
+        st.warning("None of the loaded papers fall in this year range. Search again to fetch papers for it.")
+        render_related(results["related"], query)
+        return
+
+    st.markdown(f"### Found {len(df)} papers on '{query}'")
+    if search_stats.get("offline"):
+        st.caption("Answered from papers found by earlier searches, without using Scopus quota.")
+    if search_stats.get("missing_pages"):
+        st.warning(f"{search_stats['missing_pages']} page(s) of results could not be loaded.")
+
+    render_results(df, query)
+
+    with st.expander("Digest of the top papers", expanded=st.session_state.get("research_digest") == query):
+        summarize = st.button(f"Summarize the {min(DIGEST_TOP_N, len(df))} most cited papers")
+        if summarize:
+            st.session_state["research_digest"] = query
+        if st.session_state.get("research_digest") == query:
+            render_digest(df, generate=summarize)
+
+    # Download results as CSV
+    csv = df.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="Download results as CSV",
+        data=csv,
+        file_name=f"{query.replace(' ', '_')}_research_papers.csv",
+        mime="text/csv",
+    )
+
+    render_related(results["related"], query)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,24 +1,18 @@
 import streamlit as st
-import base64
+import os
 from io import BytesIO
 from datetime import datetime
 import json
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
-from reportlab.lib import colors
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage
 from PIL import Image as PILImage
+from utils import session_memory
 
 AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
+@st.cache_resource
 def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
     return ChatOpenAI(
         model="tiiuae/falcon-180B-chat",
         api_key=AI71_API_KEY,
@@ -27,6 +21,8 @@ def get_llm():
     )
 
 def generate_resume_content(resume_data):
+    from langchain.schema import HumanMessage
+
     llm = get_llm()
     
     prompt = f"""
@@ -76,6 +72,10 @@ def generate_resume_content(resume_data):
         return resume_data
 
 def create_docx(resume_data):
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Inches, Pt
+
     doc = Document()
     
     # Styles
@@ -128,6 +128,11 @@ def create_docx(resume_data):
     return buffer
 
 def create_pdf(resume_data):
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer
+
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
     
@@ -296,7 +301,8 @@ def main():
             st.image(image, caption='Uploaded Image', use_column_width=True)
             buffered = BytesIO()
             image.save(buffered, format="PNG")
-            st.session_state.resume_data['photo'] = buffered.getvalue()
+            # Kept out of resume_data so the session memory manager can spill it
+            session_memory.put("resume_photo", buffered.getvalue())
         
         if st.button("Next"):
             if name and email and phone and location:
@@ -379,6 +385,7 @@ def main():
     # Step 5: Review and Download
     elif st.session_state.step == 5:
         st.subheader("Generated Resume")
+        resume_data = dict(st.session_state.resume_data, photo=session_memory.get("resume_photo"))
         
         # Display resume content for review
         st.write("### Personal Information")
@@ -387,8 +394,8 @@ def main():
         st.write(f"**Phone:** {st.session_state.resume_data['phone']}")
         st.write(f"**Location:** {st.session_state.resume_data['location']}")
         
-        if st.session_state.resume_data['photo']:
-            st.image(st.session_state.resume_data['photo'], caption='Your Photo', width=200)
+        if resume_data['photo']:
+            st.image(resume_data['photo'], caption='Your Photo', width=200)
         
         st.write("### Professional Summary")
         st.write(st.session_state.resume_data['summary'])
@@ -415,7 +422,7 @@ def main():
         st.write("### Download Options")
         col1, col2, col3 = st.columns(3)
         
-        docx_buffer = create_docx(st.session_state.resume_data)
+        docx_buffer = create_docx(resume_data)
         col1.download_button(
             label="Download as DOCX",
             data=docx_buffer,
@@ -423,7 +430,7 @@ def main():
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
         
-        pdf_buffer = create_pdf(st.session_state.resume_data)
+        pdf_buffer = create_pdf(resume_data)
         col2.download_button(
             label="Download as PDF",
             data=pdf_buffer,
@@ -448,6 +455,7 @@ def main():
                 'name': '', 'email': '', 'phone': '', 'location': '',
                 'summary': '', 'work_experience': [], 'education': [], 'skills': [], 'photo': None
             }
+            session_memory.pop("resume_photo")
             st.experimental_rerun()
 
 if __name__ == "__main__":
@@ -1,14 +1,8 @@
 import streamlit as st
-import random
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 import os
 from dotenv import load_dotenv
+from utils import images
+from utils.models import get_embeddings
 import tempfile
 
 # Load environment variables
@@ -18,15 +12,16 @@ AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
 # Initialize the Falcon model
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    streaming=True,
-)
-
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings()
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        streaming=True,
+    )
 
 # Expanded list of predefined topics
 PREDEFINED_TOPICS = [
@@ -71,6 +66,11 @@ PREDEFINED_TOPICS = [
 ]
 
 def process_document(file):
+    from langchain.chains import RetrievalQA
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+    from utils.hybrid_retriever import build_hybrid_retriever
+    from utils.text_splitter import get_text_splitter
+
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as temp_file:
         temp_file.write(file.getvalue())
         temp_file_path = temp_file.name
@@ -81,14 +81,13 @@ def process_document(file):
         loader = TextLoader(temp_file_path)
 
     documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = get_text_splitter()
     texts = text_splitter.split_documents(documents)
     
-    vectorstore = FAISS.from_documents(texts, embeddings)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    retriever = build_hybrid_retriever(texts, get_embeddings(), k=5)
     
     qa_chain = RetrievalQA.from_chain_type(
-        llm=chat,
+        llm=get_llm(),
         chain_type="stuff",
         retriever=retriever,
         return_source_documents=True
@@ -98,6 +97,8 @@ def process_document(file):
     return qa_chain
 
 def get_sherlock_analysis(topic, qa_chain=None):
+    from langchain.schema import HumanMessage, SystemMessage
+
     system_prompt = """
     You are Sherlock Holmes, the world's greatest detective and master of observation and deduction. 
     Your task is to provide an in-depth analysis of the given topic, offering unique insights on how to approach learning it from the ground up. 
@@ -118,7 +119,7 @@ def get_sherlock_analysis(topic, qa_chain=None):
             SystemMessage(content=system_prompt),
             HumanMessage(content=f"Analyze the following topic: {topic}")
         ]
-        response = chat.invoke(messages).content
+        response = get_llm().invoke(messages).content
     
     return response
 
@@ -171,7 +172,7 @@ def main():
             for chunk in chunks:
                 col1.markdown(chunk)
 
-    st.sidebar.image("https://upload.wikimedia.org/wikipedia/commons/c/cd/Sherlock_Holmes_Portrait_Paget.jpg", use_column_width=True)
+    st.sidebar.image(images.local_image(images.SHERLOCK_PORTRAIT_URL), use_column_width=True)
     st.sidebar.title("About S.H.E.R.L.O.C.K. Observation")
     st.sidebar.markdown("""
     S.H.E.R.L.O.C.K. Observation is your personal detective for any subject. 
@@ -1,21 +1,14 @@
 import streamlit as st
-import networkx as nx
-import plotly.graph_objects as go
 from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 import json
-import pandas as pd
 import time
 import os
-from datetime import datetime
 import random
 import re
-from PIL import Image
 import logging
+from utils import images, jobs, session_memory
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -28,12 +21,16 @@ AI71_BASE_URL = "https://api.ai71.ai/v1/"
 AI71_API_KEY = os.getenv('AI71_API_KEY')
 
 # Initialize the Falcon model
-chat = ChatOpenAI(
-    model="tiiuae/falcon-180B-chat",
-    api_key=AI71_API_KEY,
-    base_url=AI71_BASE_URL,
-    temperature=0.7,
-)
+@st.cache_resource
+def get_llm():
+    from langchain_community.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        model="tiiuae/falcon-180B-chat",
+        api_key=AI71_API_KEY,
+        base_url=AI71_BASE_URL,
+        temperature=0.7,
+    )
 
 class RoadmapStep(BaseModel):
     title: str
@@ -84,7 +81,7 @@ def ensure_valid_json(content):
         logger.debug(f"Problematic JSON: {content}")
         return None
 
-def generate_roadmap(topic):
+def generate_roadmap(topic, progress=None):
     levels = [
         "knowledge",
         "comprehension",
@@ -95,8 +92,11 @@ def generate_roadmap(topic):
     ]
 
     roadmap = Roadmap()
+    chat = get_llm()
 
-    for level in levels:
+    for i, level in enumerate(levels):
+        if progress:
+            progress(i / len(levels), f"Writing the {level} step...")
         try:
             logger.info(f"Generating roadmap step for topic: {topic} at {level} level")
             step = generate_simplified_step(topic, level, chat)
@@ -111,6 +111,9 @@ def generate_roadmap(topic):
     logger.info("Roadmap generation complete")
     return roadmap
 
+def roadmap_job(ctx, topic):
+    return generate_roadmap(topic, progress=ctx.report)
+
 def generate_diverse_resources(topic, level):
     encoded_topic = topic.replace(' ', '+')
     encoded_level = level.replace(' ', '+')
@@ -177,6 +180,9 @@ def create_fallback_step(topic, level, chat):
     )
 
 def create_interactive_graph(roadmap):
+    import networkx as nx
+    import plotly.graph_objects as go
+
     G = nx.DiGraph()
     color_map = {
         'Knowledge': '#FF6B6B',
@@ -373,7 +379,7 @@ def main():
 
     # Sidebar
     with st.sidebar:
-        st.image("https://placekitten.com/300/200", caption="S.H.E.R.L.O.C.K.", use_column_width=True)
+        st.image(images.PLACEHOLDER, caption="S.H.E.R.L.O.C.K.", use_column_width=True)
         st.markdown("""
         ## About S.H.E.R.L.O.C.K.
         **S**tudy **H**elper for **E**fficient **R**oadmaps and **L**earning **O**ptimization using **C**omprehensive **K**nowledge
@@ -420,26 +426,41 @@ def main():
     
     if st.button("🚀 Generate Roadmap"):
         if topic:
-            with st.spinner("🧠 Generating your personalized study roadmap..."):
-                try:
-                    logger.info(f"Starting roadmap generation for topic: {topic}")
-                    roadmap = generate_roadmap(topic)
-                    if roadmap and roadmap.steps:
-                        logger.info("Roadmap generated successfully")
-                        st.session_state.current_roadmap = roadmap
-                        st.session_state.current_topic = topic
-                        st.success("Roadmap generated successfully!")
-                    else:
-                        logger.warning("Generated roadmap is empty or invalid")
-                        st.error("Failed to generate a valid roadmap. Please try again with a different topic.")
-                except Exception as e:
-                    logger.error(f"Error during roadmap generation: {str(e)}", exc_info=True)
-                    st.error(f"An error occurred while generating the roadmap: {str(e)}")
+            logger.info(f"Starting roadmap generation for topic: {topic}")
+            jobs.start("roadmap", "roadmap", roadmap_job, topic)
+            st.session_state.pending_topic = topic
+
+    job = jobs.current("roadmap")
+    if job is not None:
+        if job.status == jobs.RUNNING:
+            st.progress(job.progress, text=f"🧠 Generating your personalized study roadmap... {job.message}")
+            if st.button("Cancel generation"):
+                jobs.cancel("roadmap")
+                st.experimental_rerun()
+        elif job.status == jobs.DONE:
+            jobs.clear("roadmap")
+            roadmap = job.result
+            if roadmap and roadmap.steps:
+                logger.info("Roadmap generated successfully")
+                session_memory.put("current_roadmap", roadmap)
+                st.session_state.current_topic = st.session_state.pending_topic
+                st.success("Roadmap generated successfully!")
+            else:
+                logger.warning("Generated roadmap is empty or invalid")
+                st.error("Failed to generate a valid roadmap. Please try again with a different topic.")
+        else:
+            jobs.clear("roadmap")
+            if job.status == jobs.FAILED:
+                st.error(f"An error occurred while generating the roadmap: {str(job.error)}")
+            elif job.status == jobs.CANCELLED:
+                st.info("Roadmap generation was cancelled.")
+    elif jobs.cancelled("roadmap"):
+        st.info("Roadmap generation was cancelled.")
     
-    if 'current_roadmap' in st.session_state:
+    roadmap = session_memory.get("current_roadmap")
+    if roadmap is not None:
         st.subheader(f"📊 Study Roadmap for: {st.session_state.current_topic}")
         
-        roadmap = st.session_state.current_roadmap
         fig = create_interactive_graph(roadmap)
         fig.update_layout(
             plot_bgcolor='rgba(0,0,0,0)',
@@ -478,5 +499,7 @@ def main():
             mime="application/json"
         )
 
+    jobs.poll_while_running("roadmap")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1 @@
+"""Shared helpers used by the S.H.E.R.L.O.C.K. pages."""
@@ -0,0 +1,73 @@
+"""Run many slow network calls at once, politely and within a time budget.
+
+Calls go to a worker-wide thread pool, each in a copy of the submitting
+thread's context (see utils.quota). `host_slot` caps how many of them hit
+the same host at a time, and `gather` yields results in the order they finish,
+giving up on whatever is still running once the deadline passes:
+
+    tasks = [(url, functools.partial(scrape, url)) for url in urls]
+    for url, text in fetch.gather(tasks, deadline=30):
+        ...
+"""
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, as_completed
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("SHERLOCK_FETCH_WORKERS", "16"))
+# Concurrent requests allowed to any one host
+PER_HOST_LIMIT = 4
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fetch")
+_lock = threading.Lock()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower() or url
+
+
+@contextmanager
+def host_slot(url: str):
+    """Hold one of the PER_HOST_LIMIT slots for the host of `url`."""
+    host = host_of(url)
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        slot = _host_slots[host]
+    with slot:
+        yield
+
+
+def gather(tasks: Iterable[Tuple[Hashable, Callable[[], Any]]], deadline: float) -> Iterator[Tuple[Hashable, Any]]:
+    """Run `(key, fn)` tasks concurrently and yield `(key, fn())` as each one finishes.
+
+    Failed tasks are logged and skipped. Tasks still running after `deadline`
+    seconds are abandoned, as are all pending ones if the caller stops early.
+    """
+    futures = {_executor.submit(contextvars.copy_context().run, fn): key for key, fn in tasks}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f"Fetch task {futures[future]!r} failed: {e}")
+                continue
+            yield futures[future], result
+    except TimeoutError:
+        unfinished = sum(not future.done() for future in futures)
+        logger.info(f"Fetch deadline of {deadline}s reached with {unfinished} task(s) unfinished")
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def submit(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run `fn` on the fetch pool without waiting for it, e.g. a background refresh."""
+    return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
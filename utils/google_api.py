@@ -0,0 +1,103 @@
+"""Shared Google API clients (Custom Search, YouTube Data).
+
+`build()` parses the whole discovery document and opens a new HTTP client
+on every call. Here each discovery document is parsed once per process
+(each build gets its own copy, since building modifies it), and built
+services are kept in a small per-API pool, so their keep-alive connections
+are reused too. httplib2 clients are not thread-safe, so a
+service is lent to one caller at a time:
+
+    with google_api.service("youtube", "v3", key) as youtube:
+        youtube.search().list(...).execute()
+"""
+import copy
+import json
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from utils.settings import cache_path
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+# Idle services kept per (api, version, key); more are built under load and dropped after
+MAX_IDLE_SERVICES = 8
+HTTP_TIMEOUT_SECONDS = 15
+
+_lock = threading.Lock()
+_documents: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_pools: Dict[Tuple[str, str, Optional[str]], queue.LifoQueue] = {}
+
+
+def discovery_document(api: str, version: str) -> Dict[str, Any]:
+    """Parsed discovery document: bundled with the client library, else fetched and kept on disk."""
+    key = (api, version)
+    with _lock:
+        if key in _documents:
+            return _documents[key]
+
+    from googleapiclient.discovery_cache import get_static_doc
+
+    content = get_static_doc(api, version)
+    if content is None:
+        path = cache_path("discovery", f"{api}.{version}.json")
+        try:
+            with open(path, "r") as f:
+                content = f.read()
+        except OSError:
+            import requests
+
+            response = requests.get(DISCOVERY_URL.format(api=api, version=version), timeout=HTTP_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            content = response.text
+            with open(path, "w") as f:
+                f.write(content)
+
+    document = json.loads(content)
+    with _lock:
+        return _documents.setdefault(key, document)
+
+
+def _build(api: str, version: str, developer_key: Optional[str]):
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+
+    return build_from_document(
+        # build_from_document modifies the document, and builds run concurrently
+        copy.deepcopy(discovery_document(api, version)),
+        developerKey=developer_key,
+        http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS),
+    )
+
+
+def _pool(api: str, version: str, developer_key: Optional[str]) -> queue.LifoQueue:
+    key = (api, version, developer_key)
+    with _lock:
+        if key not in _pools:
+            _pools[key] = queue.LifoQueue(maxsize=MAX_IDLE_SERVICES)
+        return _pools[key]
+
+
+@contextmanager
+def service(api: str, version: str, developer_key: Optional[str]):
+    """Borrow a built service; the most recently used one is handed out first."""
+    pool = _pool(api, version, developer_key)
+    try:
+        svc = pool.get_nowait()
+    except queue.Empty:
+        svc = _build(api, version, developer_key)
+    try:
+        yield svc
+    finally:
+        try:
+            pool.put_nowait(svc)
+        except queue.Full:
+            pass
+
+
+def prewarm(apis: Iterable[Tuple[str, str]]):
+    for api, version in apis:
+        discovery_document(api, version)
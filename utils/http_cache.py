@@ -0,0 +1,148 @@
+"""On-disk cache for fetched web content, shared by every session and worker.
+
+Entries live in one SQLite file under the cache directory and hold what
+the app actually uses (extracted page text, parsed search results), not
+raw responses. Each entry is fresh for its TTL. After that it is kept as a
+validator: its ETag / Last-Modified go out with the next request, and a
+304 renews it without another download. Least recently used entries are
+evicted once the file grows past its size limit.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from utils.settings import cache_path
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "http_cache.sqlite3"
+PAGE_TTL_SECONDS = int(float(os.getenv("SHERLOCK_PAGE_CACHE_TTL_HOURS", "168")) * 3600)
+MAX_CACHE_BYTES = int(float(os.getenv("SHERLOCK_HTTP_CACHE_MB", "64")) * 1024 * 1024)
+# Larger values are served but not stored
+MAX_ENTRY_BYTES = 256 * 1024
+# Expired entries are still worth revalidating for this long
+STALE_RETENTION_SECONDS = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+"""
+
+
+@dataclass
+class Entry:
+    value: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires > time.time()
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+
+
+def _db() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(cache_path(DB_FILE), timeout=30, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def lookup(key: str) -> Optional[Entry]:
+    """The stored entry for `key`, fresh or not."""
+    with _lock:
+        db = _db()
+        row = db.execute(
+            "SELECT value, etag, last_modified, expires FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+    return Entry(json.loads(row[0]), row[1], row[2], row[3])
+
+
+def get(key: str, default: Any = None) -> Any:
+    """The value for `key` if it is still fresh."""
+    entry = lookup(key)
+    return entry.value if entry is not None and entry.fresh else default
+
+
+def put(key: str, value: Any, ttl: float, headers: Optional[Dict[str, str]] = None):
+    """Store `value` for `ttl` seconds, with the response's validators if given."""
+    data = json.dumps(value)
+    if len(data) > MAX_ENTRY_BYTES:
+        return
+    headers = headers or {}
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, data, headers.get("ETag"), headers.get("Last-Modified"), len(data), now + ttl, now),
+        )
+        _evict(db)
+
+
+def renew(key: str, ttl: float):
+    """Mark a revalidated (304) entry fresh for another `ttl` seconds."""
+    now = time.time()
+    with _lock:
+        _db().execute("UPDATE entries SET expires = ?, accessed = ? WHERE key = ?", (now + ttl, now, key))
+
+
+def _evict(db: sqlite3.Connection, limit: int = MAX_CACHE_BYTES):
+    (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+    if total <= limit:
+        return
+    # Trim to 90% so the next few inserts don't each pay for an eviction
+    excess = total - int(limit * 0.9)
+    freed = 0
+    for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+        db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        freed += size
+        if freed >= excess:
+            break
+    logger.info(f"Evicted {freed} bytes from the HTTP cache")
+
+
+def prune():
+    """Drop entries too stale to revalidate and enforce the size limit."""
+    with _lock:
+        db = _db()
+        db.execute("DELETE FROM entries WHERE expires < ?", (time.time() - STALE_RETENTION_SECONDS,))
+        _evict(db)
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        entries, size, fresh = _db().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(expires > ?), 0) FROM entries", (time.time(),)
+        ).fetchone()
+    return {"entries": entries, "bytes": size, "fresh": fresh}
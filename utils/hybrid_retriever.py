@@ -0,0 +1,201 @@
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+from langchain_community.vectorstores import FAISS
+
+from utils.vector_index import build_vectorstore, index_folder
+
+logger = logging.getLogger(__name__)
+
+BM25_FILE = "bm25.pkl"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i in is it its of on or
+so that the their them then there these this to was what when where which who why will
+with you your
+""".split())
+
+# Queries with at most this many terms can be answered from the lexical index alone
+MAX_LEXICAL_TERMS = 4
+# ...as long as every term is selective (appears in under this share of chunks)
+MAX_LEXICAL_DF_RATIO = 0.2
+# ...and at least this many chunks contain all of the terms
+MIN_LEXICAL_MATCHES = 3
+
+# Reciprocal rank fusion damping constant
+RRF_K = 60
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with BM25 impact scores precomputed at ingestion.
+
+    Each term maps to a pair of compact arrays: the chunk positions that
+    contain it and the term's BM25 weight in each of them, so a query is
+    just a sum over a few postings lists.
+    """
+
+    def __init__(self, postings: Dict[str, Tuple[array, array]], n_docs: int):
+        self.postings = postings
+        self.n_docs = n_docs
+
+    @classmethod
+    def from_texts(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        counts = [Counter(tokenize(text)) for text in texts]
+        lengths = [sum(c.values()) for c in counts]
+        avg_length = max(sum(lengths) / len(lengths), 1.0) if lengths else 1.0
+
+        frequencies: Dict[str, Tuple[array, array]] = {}
+        for doc_id, doc_counts in enumerate(counts):
+            for term, tf in doc_counts.items():
+                docs, tfs = frequencies.setdefault(term, (array("I"), array("I")))
+                docs.append(doc_id)
+                tfs.append(tf)
+
+        n_docs = len(texts)
+        postings = {}
+        for term, (docs, tfs) in frequencies.items():
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            impacts = array("f", (
+                idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[doc_id] / avg_length))
+                for doc_id, tf in zip(docs, tfs)
+            ))
+            postings[term] = (docs, impacts)
+        return cls(postings, n_docs)
+
+    def search(self, terms: List[str], k: int) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            docs, impacts = self.postings[term]
+            for doc_id, impact in zip(docs, impacts):
+                scores[doc_id] = scores.get(doc_id, 0.0) + impact
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def is_lexical_query(self, terms: List[str]) -> bool:
+        """Short queries made only of known, selective terms ("Krebs cycle")."""
+        unique = set(terms)
+        if not unique or len(unique) > MAX_LEXICAL_TERMS:
+            return False
+        return all(
+            term in self.postings and len(self.postings[term][0]) <= self.n_docs * MAX_LEXICAL_DF_RATIO
+            for term in unique
+        )
+
+    def full_matches(self, terms: List[str]) -> int:
+        doc_sets = [set(self.postings[term][0]) for term in set(terms) if term in self.postings]
+        return len(set.intersection(*doc_sets)) if doc_sets else 0
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"postings": self.postings, "n_docs": self.n_docs}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable BM25 index {path}: {e}")
+            return None
+        return cls(data["postings"], data["n_docs"])
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int) -> List[int]:
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return [doc_id for doc_id, _ in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuse BM25 and dense results, skipping the dense path for exact-term queries.
+
+    Short queries made of selective, known terms are answered from the
+    inverted index alone when enough chunks contain all of them, which also
+    skips the query embedding. Other queries run both searches in parallel
+    and merge them with reciprocal rank fusion.
+    """
+
+    vectorstore: FAISS
+    bm25: BM25Index
+    k: int = 5
+    fetch_k: int = 20
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _document(self, position: int) -> Document:
+        return self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+
+    def _lexical_search(self, terms: List[str]) -> List[int]:
+        return [doc_id for doc_id, _ in self.bm25.search(terms, self.fetch_k)]
+
+    def _vector_search(self, query: str) -> List[int]:
+        embedding = np.array([self.vectorstore._embed_query(query)], dtype="float32")
+        _, positions = self.vectorstore.index.search(embedding, self.fetch_k)
+        return [int(p) for p in positions[0] if p >= 0]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        terms = tokenize(query)
+
+        if self.bm25.is_lexical_query(terms):
+            lexical = self._lexical_search(terms)
+            if self.bm25.full_matches(terms) >= min(MIN_LEXICAL_MATCHES, self.k):
+                return [self._document(p) for p in lexical[:self.k]]
+            vector = self._vector_search(query)
+        else:
+            vector_future = _executor.submit(self._vector_search, query)
+            lexical = self._lexical_search(terms)
+            vector = vector_future.result()
+
+        return [self._document(p) for p in reciprocal_rank_fusion([lexical, vector], self.k)]
+
+    def __reduce__(self):
+        # Pickled as its chunks, so utils.session_memory can spill it without writing out the
+        # shared embedding model; unpickling reloads the indexes from the cache directory
+        documents = [self._document(p) for p in range(len(self.vectorstore.index_to_docstore_id))]
+        return _rebuild, (documents, self.vectorstore.embedding_function.model_name, self.k)
+
+
+def build_hybrid_retriever(documents: List[Document], embeddings, k: int = 5, persist: bool = True,
+                           **kwargs) -> HybridRetriever:
+    """Build (or, with `persist`, load from cache) the FAISS store and BM25 index for `documents`."""
+    bm25 = None
+    if persist:
+        bm25_path = os.path.join(index_folder(documents, embeddings), BM25_FILE)
+        bm25 = BM25Index.load(bm25_path)
+    if bm25 is None:
+        bm25 = BM25Index.from_texts([doc.page_content for doc in documents])
+        if persist:
+            bm25.save(bm25_path)
+    vectorstore = build_vectorstore(documents, embeddings, persist=persist, **kwargs)
+    return HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=k, fetch_k=max(20, 4 * k))
+
+
+def _rebuild(documents: List[Document], model_name: str, k: int) -> HybridRetriever:
+    from utils.models import get_embeddings
+
+    return build_hybrid_retriever(documents, get_embeddings(model_name), k=k)
@@ -0,0 +1,168 @@
+"""Remote images fetched once, shrunk to display size and served from disk.
+
+`local_image(url, width)` returns the path of a JPEG no wider than `width`,
+or the bundled placeholder while the original is downloaded and recompressed
+on the fetch pool, so a slow or dead CDN never holds up a page. Background
+work that wants the real image calls `fetch_image` or `prefetch` instead.
+Anything that can't be fetched or decoded falls back to the placeholder.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from functools import partial
+from typing import Iterable, Optional
+
+from utils import fetch
+from utils.settings import PROJECT_ROOT, cache_dir
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = os.path.join(PROJECT_ROOT, "static", "placeholder.png")
+SHERLOCK_PORTRAIT_URL = "https://upload.wikimedia.org/wikipedia/commons/c/cd/Sherlock_Holmes_Portrait_Paget.jpg"
+
+# Thumbnails sit in a 1:3 column of a wide layout, so this is enough even on HiDPI screens
+DEFAULT_WIDTH = 480
+JPEG_QUALITY = 80
+MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 10
+# Wikimedia and other CDNs reject requests without a descriptive User-Agent
+USER_AGENT = "SherlockStudentGuide/1.0 (educational Streamlit app; python-requests)"
+PREFETCH_DEADLINE_SECONDS = 15
+MAX_CACHE_BYTES = int(float(os.getenv("SHERLOCK_IMAGE_CACHE_MB", "128")) * 1024 * 1024)
+# How long a URL that failed is served the placeholder before it is tried again
+FAILURE_RETRY_SECONDS = 15 * 60
+
+_lock = threading.Lock()
+# When each URL last failed, so a dead link isn't retried on every rerun
+_failed = {}
+# (url, width) pairs already queued for a background fetch
+_pending = set()
+
+
+def _path(url: str, width: int) -> str:
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(cache_dir("images"), f"{digest}_{width}.jpg")
+
+
+def _download(url: str) -> bytes:
+    import requests
+
+    with requests.get(url, timeout=DOWNLOAD_TIMEOUT_SECONDS, stream=True, headers={"User-Agent": USER_AGENT}) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"image larger than {MAX_DOWNLOAD_BYTES} bytes")
+    return bytes(data)
+
+
+def _resize(data: bytes, width: int, path: str):
+    import io
+
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        # Written under a temporary name so readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, path)
+
+
+def _cached(path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    try:
+        # prune() evicts by mtime, as atime is often not updated (noatime/relatime)
+        os.utime(path)
+    except OSError:
+        pass
+    return True
+
+
+def _failed_recently(url: str) -> bool:
+    with _lock:
+        failed_at = _failed.get(url)
+    return failed_at is not None and time.time() - failed_at < FAILURE_RETRY_SECONDS
+
+
+def fetch_image(url: Optional[str], width: int = DEFAULT_WIDTH) -> str:
+    """Like `local_image`, but downloads an uncached image before returning; for background work."""
+    if not url:
+        return PLACEHOLDER
+    try:
+        return _fetch(url, width)
+    finally:
+        with _lock:
+            _pending.discard((url, width))
+
+
+def _fetch(url: str, width: int) -> str:
+    path = _path(url, width)
+    if _cached(path):
+        return path
+    if _failed_recently(url):
+        return PLACEHOLDER
+    try:
+        _resize(_download(url), width, path)
+    except Exception as e:
+        logger.warning(f"Using placeholder for {url}: {e}")
+        with _lock:
+            _failed[url] = time.time()
+        return PLACEHOLDER
+    with _lock:
+        _failed.pop(url, None)
+    return path
+
+
+def local_image(url: Optional[str], width: int = DEFAULT_WIDTH) -> str:
+    """Path to a cached, resized copy of `url`, or to the placeholder.
+
+    Never waits on the network: an uncached image is fetched in the background
+    and shows up on a later rerun.
+    """
+    if not url:
+        return PLACEHOLDER
+    path = _path(url, width)
+    if _cached(path):
+        return path
+    if not _failed_recently(url):
+        with _lock:
+            schedule = (url, width) not in _pending
+            _pending.add((url, width))
+        if schedule:
+            fetch.submit(fetch_image, url, width)
+    return PLACEHOLDER
+
+
+def prefetch(urls: Iterable[Optional[str]], width: int = DEFAULT_WIDTH):
+    """Fetch uncached images concurrently so rendering them doesn't wait on each in turn."""
+    missing = {url for url in urls if url and not os.path.exists(_path(url, width))}
+    tasks = [(url, partial(fetch_image, url, width)) for url in missing]
+    for _ in fetch.gather(tasks, deadline=PREFETCH_DEADLINE_SECONDS):
+        pass
+
+
+def prune(limit: int = MAX_CACHE_BYTES):
+    """Delete the least recently used images once the cache is over `limit`."""
+    folder = cache_dir("images")
+    files = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        stat = os.stat(path)
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
+    with _lock:
+        cutoff = time.time() - FAILURE_RETRY_SECONDS
+        for url in [url for url, failed_at in _failed.items() if failed_at < cutoff]:
+            del _failed[url]
@@ -0,0 +1,238 @@
+"""Background jobs for long generations, so they survive reruns and page changes.
+
+Work runs in a worker-wide thread pool. Each session keeps only job IDs in
+st.session_state (one per named slot), so a rerun, a widget interaction or
+a visit to another page never restarts or throws away a running job. Pages
+submit with `start`, render `current(slot)`, and end the script with
+`poll_while_running` to refresh progress. Finished results are cached by name and arguments, and an
+identical request that is already running is shared instead of repeated.
+A shared job counts the sessions waiting on it: `cancel` detaches the
+calling session, and the work only stops once no session is left.
+"""
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("SHERLOCK_JOB_WORKERS", "4"))
+# How long a finished job stays retrievable by its ID
+JOB_RETENTION_SECONDS = 60 * 60
+DEFAULT_CACHE_TTL_SECONDS = 30 * 60
+POLL_INTERVAL_SECONDS = 1.0
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    cache_key: str
+    future: Future
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    # Sessions that started this job or joined it while it was running
+    subscribers: int = 1
+    progress: float = 0.0
+    message: str = ""
+    partial: List[Any] = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if not self.future.done():
+            return RUNNING
+        if self.cancel_event.is_set() or self.future.cancelled():
+            return CANCELLED
+        return FAILED if self.future.exception() is not None else DONE
+
+    @property
+    def result(self) -> Any:
+        return self.future.result() if self.status == DONE else None
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self.future.exception() if self.status == FAILED else None
+
+
+class JobContext:
+    """Handed to job functions for progress reporting and cancellation checks."""
+
+    def __init__(self, job: Job):
+        self._job = job
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self._job.id)
+
+    def report(self, progress: float, message: str = ""):
+        """Record progress in [0, 1]; raises JobCancelled if the job was cancelled."""
+        self._job.progress = max(0.0, min(1.0, progress))
+        self._job.message = message
+        self.check_cancelled()
+
+    def emit(self, item: Any):
+        """Publish a partial result the page can render before the job finishes."""
+        self._job.partial.append(item)
+        self.check_cancelled()
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+_lock = threading.Lock()
+_jobs: Dict[str, Job] = {}
+_running_by_key: Dict[str, str] = {}
+_result_cache: Dict[str, Tuple[float, Any]] = {}
+
+
+def _cache_key(name: str, args: tuple, kwargs: dict) -> str:
+    return hashlib.sha256(repr((name, args, sorted(kwargs.items()))).encode("utf-8")).hexdigest()
+
+
+def _purge_expired():
+    now = time.time()
+    for job_id, job in list(_jobs.items()):
+        if job.finished and now - job.finished > JOB_RETENTION_SECONDS:
+            del _jobs[job_id]
+    for key, (expires, _) in list(_result_cache.items()):
+        if expires < now:
+            del _result_cache[key]
+
+
+def submit(name: str, fn: Callable[..., Any], *args, cache_ttl: float = DEFAULT_CACHE_TTL_SECONDS, **kwargs) -> str:
+    """Run `fn(ctx, *args, **kwargs)` in the background and return its job ID."""
+    key = _cache_key(name, args, kwargs)
+    with _lock:
+        _purge_expired()
+        if key in _running_by_key:
+            shared = _jobs[_running_by_key[key]]
+            shared.subscribers += 1
+            return shared.id
+
+        job_id = uuid.uuid4().hex
+        future: Future = Future()
+        job = Job(job_id, name, key, future)
+        _jobs[job_id] = job
+
+        cached = _result_cache.get(key)
+        if cached is not None:
+            job.progress, job.message, job.finished = 1.0, "Loaded from cache", time.time()
+            future.set_result(cached[1])
+            return job_id
+        _running_by_key[key] = job_id
+
+    def run():
+        ctx = JobContext(job)
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            result = fn(ctx, *args, **kwargs)
+            ctx.check_cancelled()
+        except JobCancelled as e:
+            future.set_exception(e)
+        except Exception as e:
+            logger.error(f"Job {name} ({job_id[:8]}) failed: {e}", exc_info=True)
+            future.set_exception(e)
+        else:
+            job.progress = 1.0
+            future.set_result(result)
+            if cache_ttl:
+                with _lock:
+                    _result_cache[key] = (time.time() + cache_ttl, result)
+        finally:
+            job.finished = time.time()
+            with _lock:
+                # A cancelled job's key may already belong to a newer identical job
+                if _running_by_key.get(key) == job_id:
+                    del _running_by_key[key]
+
+    # Run in a copy of the caller's context so quota charges stay attributed to its page
+    _executor.submit(contextvars.copy_context().run, run)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def release(job_id: str):
+    """Drop one subscriber from a job, and stop it if that was the last one."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.subscribers -= 1
+        if job.subscribers > 0 or job.future.done():
+            return
+        job.cancel_event.set()
+        if _running_by_key.get(job.cache_key) == job_id:
+            del _running_by_key[job.cache_key]
+
+
+def cancel(slot: str):
+    """Detach this session from the job in `slot`; other sessions sharing it keep theirs."""
+    job_id = st.session_state.get("jobs", {}).pop(slot, None)
+    if job_id is not None:
+        release(job_id)
+        st.session_state.setdefault("jobs_cancelled", set()).add(slot)
+
+
+def cancelled(slot: str) -> bool:
+    """Whether this session's last job in `slot` was cancelled and nothing has been started since."""
+    return slot in st.session_state.get("jobs_cancelled", set())
+
+
+def start(slot: str, name: str, fn: Callable[..., Any], *args, **kwargs) -> str:
+    """Submit a job and remember its ID in this session under `slot`."""
+    previous = st.session_state.get("jobs", {}).get(slot)
+    job_id = submit(name, fn, *args, **kwargs)
+    if previous is not None:
+        # The job this one replaces no longer has this session waiting on it
+        # (when it is the same running job, submit just counted this session twice)
+        release(previous)
+    st.session_state.setdefault("jobs", {})[slot] = job_id
+    st.session_state.get("jobs_cancelled", set()).discard(slot)
+    return job_id
+
+
+def current(slot: str) -> Optional[Job]:
+    job_id = st.session_state.get("jobs", {}).get(slot)
+    return get_job(job_id) if job_id else None
+
+
+def clear(slot: str):
+    st.session_state.get("jobs", {}).pop(slot, None)
+
+
+def poll(interval: float = POLL_INTERVAL_SECONDS):
+    """Rerun the page shortly to pick up job progress."""
+    time.sleep(interval)
+    st.experimental_rerun()
+
+
+def poll_while_running(*slots: str, interval: float = POLL_INTERVAL_SECONDS):
+    """Call at the end of a page so the rest of it renders before the rerun."""
+    running = [job for job in map(current, slots) if job is not None and job.status == RUNNING]
+    if running:
+        poll(interval)
@@ -0,0 +1,59 @@
+"""Model handles shared by every page in the worker process.
+
+Each handle is loaded once per process, whichever page (or the warmup
+stage) asks first, so two pages using the same embedding model never hold
+two copies of it.
+"""
+import logging
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Default model behind HuggingFaceEmbeddings(); utils.text_splitter counts tokens with it
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+# Smaller model used by the mind palace page
+MINI_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+FACE_CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+_lock = threading.Lock()
+# Every handle loaded so far, for utils.session_memory to leave out of per-session sizes
+_loaded = []
+
+
+@lru_cache(maxsize=None)
+def _load_embeddings(model_name: str):
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    logger.info(f"Loading embedding model {model_name}")
+    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    _loaded.append(embeddings)
+    return embeddings
+
+
+def get_embeddings(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    # The lock keeps concurrent first calls from loading the model twice
+    with _lock:
+        return _load_embeddings(model_name)
+
+
+@lru_cache(maxsize=None)
+def _load_face_cascade():
+    import cv2
+
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + FACE_CASCADE_FILE)
+    if cascade.empty():
+        raise RuntimeError(f"Could not load {FACE_CASCADE_FILE} from {cv2.data.haarcascades}")
+    _loaded.append(cascade)
+    return cascade
+
+
+def get_face_cascade():
+    with _lock:
+        return _load_face_cascade()
+
+
+def loaded_handles() -> list:
+    with _lock:
+        return list(_loaded)
@@ -0,0 +1,322 @@
+"""Every Scopus record the app has fetched, searchable offline.
+
+Records are upserted into SQLite, deduplicated by DOI (or EID when there is
+none), with an FTS5 index over titles and abstracts and an embedding per
+abstract. The ranked list each query and year range returned is kept too:
+repeating a search is answered entirely from here. Stored papers that match
+a new query by full text or embedding are offered as related papers, kept
+apart from its results; only what the API itself returned for a query is
+recorded and served as that query's results.
+
+Abstracts are embedded on the fetch pool after they are stored, so saving
+a page of results never waits on the model. LLM digests of abstracts are
+kept here too, by DOI, and shared by every session.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import fetch
+from utils.models import MINI_EMBEDDING_MODEL
+from utils.settings import cache_path
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "papers.sqlite3"
+EMBEDDING_MODEL = MINI_EMBEDDING_MODEL
+# How long a query's stored result list stands in for the API
+QUERY_TTL_SECONDS = 7 * 24 * 3600
+# Cosine similarity an abstract needs to count as a related match
+MIN_SIMILARITY = 0.45
+# Candidates taken from each index before fusing the rankings
+CANDIDATES = 200
+# Digests are regenerated after this long, so a poor one doesn't stick forever
+DIGEST_TTL_SECONDS = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    key TEXT PRIMARY KEY,
+    doi TEXT,
+    eid TEXT,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    year INTEGER,
+    journal TEXT,
+    abstract TEXT NOT NULL,
+    citations INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    vector BLOB,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS papers_year ON papers (year);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5 (key UNINDEXED, title, abstract);
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT NOT NULL,
+    start_year INTEGER NOT NULL,
+    end_year INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    PRIMARY KEY (query, start_year, end_year)
+);
+CREATE TABLE IF NOT EXISTS query_papers (
+    query TEXT NOT NULL,
+    start_year INTEGER NOT NULL,
+    end_year INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (query, start_year, end_year, rank)
+);
+CREATE TABLE IF NOT EXISTS digests (
+    doi TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+_embedding = threading.Lock()
+
+
+def _db() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(cache_path(DB_FILE), timeout=30, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def paper_key(record: Dict[str, Any]) -> Optional[str]:
+    doi = record.get("prism:doi")
+    if doi:
+        return f"doi:{doi.lower()}"
+    eid = record.get("eid")
+    return f"eid:{eid}" if eid else None
+
+
+def _authors(record: Dict[str, Any]) -> str:
+    author = record.get("author") or []
+    if isinstance(author, dict):
+        author = [author]
+    return ", ".join(a.get("authname", "") for a in author)
+
+
+def _year(record: Dict[str, Any]) -> Optional[int]:
+    year = (record.get("prism:coverDate") or "")[:4]
+    return int(year) if year.isdigit() else None
+
+
+def upsert(records: List[Dict[str, Any]]) -> int:
+    """Store or refresh Scopus records; returns how many were new."""
+    added = 0
+    now = time.time()
+    with _lock:
+        db = _db()
+        with db:
+            for record in records:
+                key = paper_key(record)
+                if key is None:
+                    continue
+                existing = db.execute("SELECT 1 FROM papers WHERE key = ?", (key,)).fetchone()
+                title, abstract = record.get("dc:title") or "", record.get("dc:description") or ""
+                fields = (
+                    record.get("prism:doi"), record.get("eid"), title, _authors(record), _year(record),
+                    record.get("prism:publicationName"), abstract, int(record.get("citedby-count") or 0),
+                    json.dumps(record), now,
+                )
+                if existing:
+                    # Citation counts and metadata move; the abstract (and its vector) rarely does
+                    db.execute(
+                        "UPDATE papers SET doi = ?, eid = ?, title = ?, authors = ?, year = ?, journal = ?, abstract = ?, "
+                        "citations = ?, record = ?, updated = ? WHERE key = ?",
+                        (*fields, key),
+                    )
+                    db.execute("DELETE FROM papers_fts WHERE key = ?", (key,))
+                else:
+                    db.execute("INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)", (key, *fields))
+                    added += 1
+                db.execute("INSERT INTO papers_fts VALUES (?, ?, ?)", (key, title, abstract))
+    if added:
+        fetch.submit(embed_pending)
+    return added
+
+
+def embed_pending(batch_size: int = 64):
+    """Embed abstracts stored without a vector yet."""
+    import numpy as np
+
+    from utils.models import get_embeddings
+
+    # One embedding pass at a time; later calls find nothing left to do
+    with _embedding:
+        while True:
+            with _lock:
+                rows = _db().execute(
+                    "SELECT key, title, abstract FROM papers WHERE vector IS NULL LIMIT ?", (batch_size,)
+                ).fetchall()
+            if not rows:
+                return
+            try:
+                vectors = np.asarray(
+                    get_embeddings(EMBEDDING_MODEL).embed_documents([f"{title}. {abstract}" for _, title, abstract in rows]),
+                    dtype="float32",
+                )
+            except Exception as e:
+                # Left without vectors, these are retried after the next upsert
+                logger.warning(f"Embedding {len(rows)} paper abstracts failed: {e}")
+                return
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            with _lock:
+                db = _db()
+                with db:
+                    db.executemany(
+                        "UPDATE papers SET vector = ? WHERE key = ?",
+                        [(vector.tobytes(), key) for (key, _, _), vector in zip(rows, vectors)],
+                    )
+
+
+def record_query(query: str, start_year: int, end_year: int, records: List[Dict[str, Any]], total: int):
+    """Remember the ranked results `query` returned, so repeating it needs no API call."""
+    query = _normalize(query)
+    keys = list(dict.fromkeys(key for key in map(paper_key, records) if key))
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM query_papers WHERE query = ? AND start_year = ? AND end_year = ?", (query, start_year, end_year))
+            db.executemany(
+                "INSERT INTO query_papers VALUES (?, ?, ?, ?, ?)",
+                [(query, start_year, end_year, rank, key) for rank, key in enumerate(keys)],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)", (query, start_year, end_year, total, time.time())
+            )
+
+
+def _records(db: sqlite3.Connection, keys: List[str]) -> List[Dict[str, Any]]:
+    records = []
+    for key in keys:
+        row = db.execute("SELECT record FROM papers WHERE key = ?", (key,)).fetchone()
+        if row:
+            records.append(json.loads(row[0]))
+    return records
+
+
+def _lexical(db: sqlite3.Connection, query: str, start_year: int, end_year: int) -> List[str]:
+    from utils.hybrid_retriever import tokenize
+
+    terms = tokenize(query)
+    if not terms:
+        return []
+    # Every term must appear; looser matches are left to the embeddings
+    match = " ".join(f'"{term}"' for term in terms)
+    rows = db.execute(
+        "SELECT papers_fts.key FROM papers_fts JOIN papers ON papers.key = papers_fts.key "
+        "WHERE papers_fts MATCH ? AND papers.year BETWEEN ? AND ? ORDER BY bm25(papers_fts) LIMIT ?",
+        (match, start_year, end_year, CANDIDATES),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _semantic(rows: List[Tuple[str, bytes]], query: str) -> List[str]:
+    import numpy as np
+
+    from utils.models import get_embeddings
+
+    if not rows:
+        return []
+    matrix = np.stack([np.frombuffer(vector, dtype="float32") for _, vector in rows])
+    query_vector = np.asarray(get_embeddings(EMBEDDING_MODEL).embed_query(query), dtype="float32")
+    scores = matrix @ (query_vector / (np.linalg.norm(query_vector) + 1e-12))
+    order = np.argsort(-scores)[:CANDIDATES]
+    return [rows[i][0] for i in order if scores[i] >= MIN_SIMILARITY]
+
+
+def search(query: str, start_year: int, end_year: int,
+           limit: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], bool]:
+    """Stored results of the query, related papers, and whether the results make an API call unnecessary.
+
+    Results are those an earlier identical search returned, in their
+    original order. Related papers are other stored papers in the year range,
+    ranked by fusing full-text and embedding matches; the API never returned
+    them for this query, so they are not part of its results.
+    """
+    from utils.hybrid_retriever import RRF_K
+
+    normalized = _normalize(query)
+    with _lock:
+        db = _db()
+        known = db.execute(
+            "SELECT total, fetched FROM queries WHERE query = ? AND start_year = ? AND end_year = ?",
+            (normalized, start_year, end_year),
+        ).fetchone()
+        exact = [
+            row[0] for row in db.execute(
+                "SELECT key FROM query_papers WHERE query = ? AND start_year = ? AND end_year = ? ORDER BY rank",
+                (normalized, start_year, end_year),
+            )
+        ]
+        lexical = _lexical(db, query, start_year, end_year)
+        vectors = db.execute(
+            "SELECT key, vector FROM papers WHERE vector IS NOT NULL AND year BETWEEN ? AND ?", (start_year, end_year)
+        ).fetchall()
+    # Embedding the query can be slow; other sessions shouldn't wait on it
+    semantic = _semantic(vectors, query)
+
+    scores: Dict[str, float] = {}
+    for ranking in (lexical, semantic):
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    seen = set(exact)
+    related = [key for key in sorted(scores, key=lambda key: -scores[key]) if key not in seen][:limit]
+
+    complete = (
+        known is not None
+        and time.time() - known[1] < QUERY_TTL_SECONDS
+        and len(exact) >= min(limit, known[0])
+    )
+    with _lock:
+        db = _db()
+        return _records(db, exact[:limit]), _records(db, related), complete
+
+
+def digests(dois: List[str]) -> Dict[str, str]:
+    """Stored digests, younger than DIGEST_TTL_SECONDS, for whichever of these DOIs have one."""
+    found = {}
+    with _lock:
+        db = _db()
+        for doi in dois:
+            row = db.execute(
+                "SELECT digest FROM digests WHERE doi = ? AND created > ?", (doi.lower(), time.time() - DIGEST_TTL_SECONDS)
+            ).fetchone()
+            if row:
+                found[doi] = row[0]
+    return found
+
+
+def save_digests(digests_by_doi: Dict[str, str]):
+    now = time.time()
+    with _lock:
+        db = _db()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?)",
+                [(doi.lower(), digest, now) for doi, digest in digests_by_doi.items()],
+            )
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        db = _db()
+        (papers,) = db.execute("SELECT COUNT(*) FROM papers").fetchone()
+        (embedded,) = db.execute("SELECT COUNT(*) FROM papers WHERE vector IS NOT NULL").fetchone()
+        (queries,) = db.execute("SELECT COUNT(*) FROM queries").fetchone()
+        (digested,) = db.execute("SELECT COUNT(*) FROM digests").fetchone()
+    return {"papers": papers, "embedded": embedded, "queries": queries, "digests": digested}
@@ -0,0 +1,205 @@
+"""Exam questions kept from earlier generations and served again.
+
+Questions are stored in SQLite together with their embeddings, under the
+topic they were generated for. A request is matched to every stored topic
+whose embedding is close enough to its own, so "photosynthesis" and
+"Photosynthesis in plants" share a bank. `sample` draws a random subset,
+and the caller only asks the LLM for the shortfall. New questions too
+similar to ones already banked for the topic are not stored twice.
+
+Counters of questions requested and served from the bank give the hit rate
+shown on the admin dashboard.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.settings import cache_path
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "question_bank.sqlite3"
+# Cosine similarity above which two topic strings share a bank
+TOPIC_SIMILARITY = 0.85
+# ...and above which a new question duplicates a banked one
+DUPLICATE_SIMILARITY = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    id INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL UNIQUE,
+    vector BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    topic_id INTEGER NOT NULL REFERENCES topics (id),
+    difficulty TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic_id, difficulty);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+# Topic vectors, loaded once and kept in step with the topics table
+_topic_ids: List[int] = []
+_topic_matrix = None
+
+
+def _db() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(cache_path(DB_FILE), timeout=30, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def _embed(texts: List[str]):
+    import numpy as np
+
+    from utils.models import get_embeddings
+
+    vectors = np.asarray(get_embeddings().embed_documents(texts), dtype="float32")
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+
+def _load_topics(db: sqlite3.Connection):
+    global _topic_matrix
+    import numpy as np
+
+    if _topic_matrix is None:
+        rows = db.execute("SELECT id, vector FROM topics ORDER BY id").fetchall()
+        _topic_ids[:] = [row[0] for row in rows]
+        if rows:
+            _topic_matrix = np.stack([np.frombuffer(row[1], dtype="float32") for row in rows])
+        else:
+            _topic_matrix = np.zeros((0, 0), dtype="float32")
+    return _topic_matrix
+
+
+def _matching_topics(topic_vector) -> List[int]:
+    with _lock:
+        matrix = _load_topics(_db())
+        if not len(matrix):
+            return []
+        scores = matrix @ topic_vector
+        return [_topic_ids[i] for i in (scores >= TOPIC_SIMILARITY).nonzero()[0]]
+
+
+def _topic_id(topic: str, topic_vector) -> int:
+    global _topic_matrix
+    import numpy as np
+
+    with _lock:
+        db = _db()
+        row = db.execute("SELECT id FROM topics WHERE topic = ?", (topic,)).fetchone()
+        if row:
+            return row[0]
+        matrix = _load_topics(db)
+        topic_id = db.execute(
+            "INSERT INTO topics (topic, vector) VALUES (?, ?)", (topic, topic_vector.tobytes())
+        ).lastrowid
+        _topic_ids.append(topic_id)
+        _topic_matrix = np.vstack([matrix, topic_vector]) if len(matrix) else topic_vector[None, :]
+        return topic_id
+
+
+def _normalize_topic(topic: str) -> str:
+    return " ".join(topic.lower().split())
+
+
+def sample(topic: str, difficulty: str, include_answers: bool, count: int) -> List[Tuple[Dict[str, str], Any]]:
+    """Up to `count` random banked questions for the topic, as (question, vector) pairs."""
+    import numpy as np
+
+    topic_ids = _matching_topics(_embed([_normalize_topic(topic)])[0])
+    if not topic_ids:
+        return []
+    placeholders = ",".join("?" * len(topic_ids))
+    query = f"SELECT id, question, answer, vector FROM questions WHERE topic_id IN ({placeholders}) AND difficulty = ?"
+    if include_answers:
+        query += " AND answer != ''"
+    with _lock:
+        rows = _db().execute(query, (*topic_ids, difficulty)).fetchall()
+    rows = random.sample(rows, min(count, len(rows)))
+    return [
+        ({"question": question, "answer": answer}, np.frombuffer(vector, dtype="float32"))
+        for _, question, answer, vector in rows
+    ]
+
+
+def add(topic: str, difficulty: str, questions: List[Tuple[Dict[str, str], Any]]) -> int:
+    """Bank new (question, vector) pairs, skipping near-duplicates; returns how many were stored."""
+    import numpy as np
+
+    if not questions:
+        return 0
+    topic = _normalize_topic(topic)
+    topic_id = _topic_id(topic, _embed([topic])[0])
+    with _lock:
+        db = _db()
+        banked = [
+            np.frombuffer(row[0], dtype="float32")
+            for row in db.execute("SELECT vector FROM questions WHERE topic_id = ? AND difficulty = ?", (topic_id, difficulty))
+        ]
+        stored = 0
+        now = time.time()
+        for question, vector in questions:
+            if banked and float(np.max(np.asarray(banked) @ vector)) >= DUPLICATE_SIMILARITY:
+                continue
+            db.execute(
+                "INSERT INTO questions (topic_id, difficulty, question, answer, vector, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (topic_id, difficulty, question["question"], question["answer"], np.asarray(vector, dtype="float32").tobytes(), now),
+            )
+            banked.append(vector)
+            stored += 1
+    return stored
+
+
+def record(requested: int, served: int):
+    """Count one request for `requested` questions, `served` of which came from the bank."""
+    with _lock:
+        db = _db()
+        for name, value in (("requests", 1), ("requested", requested), ("served", served)):
+            db.execute(
+                "INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, value),
+            )
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        db = _db()
+        counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+        (questions,) = db.execute("SELECT COUNT(*) FROM questions").fetchone()
+        (topics,) = db.execute("SELECT COUNT(*) FROM topics").fetchone()
+    requested = counters.get("requested", 0)
+    return {
+        "topics": topics,
+        "questions": questions,
+        "requests": counters.get("requests", 0),
+        "requested": requested,
+        "served": counters.get("served", 0),
+        "hit_rate": counters.get("served", 0) / requested if requested else 0.0,
+    }
+
+
+def render_bank_dashboard():
+    import streamlit as st
+
+    bank = stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Banked questions", bank["questions"], help=f"across {bank['topics']} topics")
+    col2.metric("Requests", bank["requests"])
+    col3.metric("Served from bank", f"{100 * bank['hit_rate']:.0f}%", help=f"{bank['served']} of {bank['requested']} questions")
@@ -0,0 +1,172 @@
+"""Ledger of external API quota spent, with daily budgets per API and per session.
+
+Every billable call is charged here first, attributed to the page and the
+session that caused it, and persisted in SQLite so restarts don't reset
+the count. `charge` raises QuotaExceeded once today's deployment-wide
+budget for the API is spent, or once one session has used its share of
+it. utils.search_cache falls back to whatever results it has cached when
+that happens.
+
+Attribution follows the work: app.py calls `attribute(page)` on each run,
+and the job and fetch pools carry the caller's context into their threads.
+"""
+import contextvars
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.settings import cache_path
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "quota.sqlite3"
+
+
+def _budget(api: str, default: int) -> int:
+    return int(os.getenv(f"SHERLOCK_QUOTA_{api.upper()}", str(default)))
+
+
+# Units per day. YouTube Data API grants 10,000; Custom Search's free tier is
+# 100 queries; Scopus allows 20,000 searches a week, spread evenly here
+DAILY_BUDGETS: Dict[str, int] = {
+    "youtube": _budget("youtube", 10_000),
+    "customsearch": _budget("customsearch", 100),
+    "scopus": _budget("scopus", 20_000 // 7),
+}
+# Fraction of an API's daily budget any one session may spend
+SESSION_SHARE = float(os.getenv("SHERLOCK_QUOTA_SESSION_SHARE", "0.25"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    api TEXT NOT NULL,
+    page TEXT NOT NULL,
+    session TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    PRIMARY KEY (day, api, page, session)
+);
+"""
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+_caller: contextvars.ContextVar = contextvars.ContextVar("quota_caller", default=None)
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+
+
+def _db() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(cache_path(DB_FILE), timeout=30, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def _today() -> str:
+    # Budgets reset at midnight UTC
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _session_id() -> Optional[str]:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def attribute(page: str):
+    """Charge calls made from here on (in this script run and work it starts) to `page`."""
+    _caller.set((page, _session_id() or "background"))
+
+
+def caller() -> Tuple[str, str]:
+    current = _caller.get()
+    if current is not None:
+        return current
+    return "unknown", _session_id() or "background"
+
+
+def charge(api: str, units: int):
+    """Record `units` spent on `api`, or raise QuotaExceeded if that would go over budget."""
+    page, session = caller()
+    day = _today()
+    budget = DAILY_BUDGETS.get(api)
+    with _lock:
+        db = _db()
+        # Check and record in one write transaction, so other worker processes can't both pass the check
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if budget is not None:
+                (total,) = db.execute(
+                    "SELECT COALESCE(SUM(units), 0) FROM usage WHERE day = ? AND api = ?", (day, api)
+                ).fetchone()
+                if total + units > budget:
+                    raise QuotaExceeded(f"Today's {api} quota ({budget} units) is used up")
+                (mine,) = db.execute(
+                    "SELECT COALESCE(SUM(units), 0) FROM usage WHERE day = ? AND api = ? AND session = ?", (day, api, session)
+                ).fetchone()
+                if session != "background" and mine + units > budget * SESSION_SHARE:
+                    raise QuotaExceeded(f"This session has used its share of today's {api} quota")
+            db.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT (day, api, page, session) "
+                "DO UPDATE SET calls = calls + 1, units = units + excluded.units",
+                (day, api, page, session, units),
+            )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+
+def usage_report(day: Optional[str] = None) -> Dict[str, Any]:
+    """Today's (or `day`'s) usage by API, by page and by heaviest session."""
+    day = day or _today()
+    with _lock:
+        db = _db()
+        by_api = db.execute(
+            "SELECT api, SUM(calls), SUM(units) FROM usage WHERE day = ? GROUP BY api", (day,)
+        ).fetchall()
+        by_page = db.execute(
+            "SELECT api, page, SUM(calls), SUM(units) FROM usage WHERE day = ? GROUP BY api, page ORDER BY SUM(units) DESC",
+            (day,),
+        ).fetchall()
+        by_session = db.execute(
+            "SELECT api, session, SUM(units) FROM usage WHERE day = ? GROUP BY api, session ORDER BY SUM(units) DESC LIMIT 10",
+            (day,),
+        ).fetchall()
+    apis: List[Dict[str, Any]] = []
+    for api, calls, units in by_api:
+        budget = DAILY_BUDGETS.get(api)
+        apis.append({"api": api, "calls": calls, "units": units, "budget": budget,
+                     "used": f"{100 * units / budget:.0f}%" if budget else "-"})
+    return {
+        "day": day,
+        "apis": apis,
+        "pages": [{"api": api, "page": page, "calls": calls, "units": units} for api, page, calls, units in by_page],
+        "sessions": [{"api": api, "session": session[:8], "units": units} for api, session, units in by_session],
+    }
+
+
+def render_quota_dashboard():
+    import streamlit as st
+
+    report = usage_report()
+    if not report["apis"]:
+        st.write(f"No API quota spent on {report['day']} (UTC).")
+        return
+    st.dataframe(report["apis"], use_container_width=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.caption("By page")
+        st.dataframe(report["pages"], use_container_width=True)
+    with col2:
+        st.caption("Heaviest sessions")
+        st.dataframe(report["sessions"], use_container_width=True)
@@ -0,0 +1,135 @@
+"""Visible text from a web page, reading no more of it than needed.
+
+The body is streamed and fed to an incremental parser chunk by chunk, and
+the download stops as soon as `max_chars` of visible text have been seen
+or `max_bytes` have been read, whichever comes first. Script, style and
+other non-rendered content is skipped, and runs of whitespace collapse to
+a single space. Results go through utils.http_cache, so a page already read
+by any session is not downloaded again.
+"""
+import codecs
+import logging
+import re
+from html.parser import HTMLParser
+
+from utils import http_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024
+DEFAULT_TIMEOUT_SECONDS = 10
+CHUNK_SIZE = 16 * 1024
+USER_AGENT = "Mozilla/5.0 (compatible; SherlockStudentGuide/1.0)"
+
+# Elements whose content is never rendered as text
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "object"}
+
+WHITESPACE = re.compile(r"\s+")
+CHARSET = re.compile(rb"""charset\s*=\s*["']?([\w.:-]+)""", re.I)
+# How much of the body to search for a <meta> charset declaration
+SNIFF_BYTES = 4096
+
+
+class _TextCollector(HTMLParser):
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self._skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        return self.length >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        # Keep text from neighbouring elements from running together
+        self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        self.parts.append(" ")
+
+    def handle_data(self, data):
+        if self._skip_depth or self.full:
+            return
+        text = WHITESPACE.sub(" ", data)
+        if text.strip():
+            self.parts.append(text)
+            self.length += len(text)
+
+    def text(self) -> str:
+        return WHITESPACE.sub(" ", "".join(self.parts)).strip()[:self.max_chars]
+
+
+def _decoder(encoding):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+def _encoding(content_type: str, first_chunk: bytes) -> str:
+    """The charset from the Content-Type header, else a BOM or <meta> tag, else UTF-8.
+
+    requests reports ISO-8859-1 for any text/* response without a charset,
+    which garbles most of today's pages, so its guess is not used.
+    """
+    declared = CHARSET.search(content_type.encode("latin-1", "replace"))
+    if declared:
+        return declared.group(1).decode("ascii")
+    if first_chunk.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if first_chunk.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    head = first_chunk[:SNIFF_BYTES]
+    meta = re.search(rb"<meta[^>]+" + CHARSET.pattern, head, re.I)
+    return meta.group(1).decode("ascii") if meta else "utf-8"
+
+
+def visible_text(url: str, max_chars: int, max_bytes: int = DEFAULT_MAX_BYTES,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS, ttl: float = http_cache.PAGE_TTL_SECONDS) -> str:
+    """Return up to `max_chars` of the page's visible text, or "" if it can't be read.
+
+    Text is served from utils.http_cache while fresh; a stale copy is revalidated
+    with a conditional GET, and is still returned if the site can't be reached.
+    """
+    import requests
+
+    key = f"text:{max_chars}:{url}"
+    cached = http_cache.lookup(key)
+    if cached is not None and cached.fresh:
+        return cached.value
+
+    headers = {"User-Agent": USER_AGENT}
+    if cached is not None:
+        headers.update(cached.conditional_headers())
+    try:
+        with requests.get(url, timeout=timeout, stream=True, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                http_cache.renew(key, ttl)
+                return cached.value
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "text/html")
+            if "html" not in content_type and not content_type.startswith("text/"):
+                text = ""
+            else:
+                decoder = None
+                collector = _TextCollector(max_chars)
+                received = 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if decoder is None:
+                        decoder = _decoder(_encoding(content_type, chunk))
+                    received += len(chunk)
+                    collector.feed(decoder.decode(chunk))
+                    if collector.full or received >= max_bytes:
+                        break
+                text = collector.text()
+            http_cache.put(key, text, ttl, response.headers)
+            return text
+    except Exception as e:
+        logger.warning(f"Error scraping {url}: {e}")
+        return cached.value if cached is not None else ""
@@ -0,0 +1,154 @@
+"""Search results shared across sessions, with stale-while-revalidate.
+
+`cached(source, params, fetch_fn)` keys results by source and parameters,
+ignoring case and extra whitespace in the free-text query, and keeps them in
+utils.http_cache. Within the source's TTL a repeat search costs nothing.
+For a while after that, the stale results are returned at once while a
+background refresh fetches new ones. Past that window the caller waits for
+a fresh fetch. Per-source counters track how many API calls, and quota
+units, the cache has saved; `cached_with_cost` also tells the caller what
+its own call was charged.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Tuple
+
+from utils import fetch, http_cache, quota
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SourcePolicy:
+    ttl: float
+    # How long past the TTL results are still served while refreshing
+    stale_window: float
+    # Quota units one uncached call costs
+    cost_units: int
+
+
+HOUR = 3600
+SOURCES: Dict[str, SourcePolicy] = {
+    "youtube": SourcePolicy(ttl=6 * HOUR, stale_window=48 * HOUR, cost_units=100),
+    "customsearch": SourcePolicy(ttl=24 * HOUR, stale_window=7 * 24 * HOUR, cost_units=1),
+    "scopus": SourcePolicy(ttl=24 * HOUR, stale_window=7 * 24 * HOUR, cost_units=1),
+}
+
+_lock = threading.Lock()
+_refreshing = set()
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+
+# Free-text query parameters; everything else (page tokens, engine IDs, ...)
+# can be case-sensitive and is keyed as given
+QUERY_PARAMS = {"q", "query"}
+
+
+def _normalize(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: " ".join(value.lower().split()) if key in QUERY_PARAMS and isinstance(value, str) else value
+        for key, value in params.items()
+    }
+
+
+def cache_key(source: str, params: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(json.dumps(_normalize(params), sort_keys=True, default=str).encode("utf-8"))
+    return f"search:{source}:{digest.hexdigest()[:32]}"
+
+
+def _count(source: str, name: str, amount: int = 1):
+    with _lock:
+        _counters[source][name] += amount
+
+
+def _refresh(source: str, key: str, fetch_fn: Callable[[], Any]):
+    try:
+        quota.charge(source, SOURCES[source].cost_units)
+        http_cache.put(key, fetch_fn(), SOURCES[source].ttl)
+        _count(source, "refreshes")
+    except quota.QuotaExceeded as e:
+        logger.info(f"Skipped refreshing {source} results: {e}")
+    except Exception as e:
+        logger.warning(f"Background refresh of {source} results failed: {e}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def cached(source: str, params: Dict[str, Any], fetch_fn: Callable[[], Any]) -> Any:
+    """Results of `fetch_fn()` for these parameters, from the cache when possible.
+
+    Exceptions from `fetch_fn` propagate, and nothing is cached for them. Each
+    real call is charged to utils.quota; over budget, old results are served
+    regardless of age, and QuotaExceeded is raised if there are none.
+    """
+    return cached_with_cost(source, params, fetch_fn)[0]
+
+
+def cached_with_cost(source: str, params: Dict[str, Any], fetch_fn: Callable[[], Any]) -> Tuple[Any, int]:
+    """Like `cached`, but also returns the quota units this call was charged.
+
+    A background refresh started by a stale hit is charged to the same
+    caller later, and is not included.
+    """
+    policy = SOURCES[source]
+    key = cache_key(source, params)
+    entry = http_cache.lookup(key)
+    if entry is not None and entry.fresh:
+        _count(source, "hits")
+        _count(source, "units_saved", policy.cost_units)
+        return entry.value, 0
+
+    if entry is not None and time.time() - entry.expires < policy.stale_window:
+        # Nothing saved: the refresh spends the units a miss would have
+        _count(source, "stale_hits")
+        with _lock:
+            start_refresh = key not in _refreshing
+            _refreshing.add(key)
+        if start_refresh:
+            fetch.submit(_refresh, source, key, fetch_fn)
+        return entry.value, 0
+
+    try:
+        quota.charge(source, policy.cost_units)
+    except quota.QuotaExceeded:
+        # Over budget: any cached results, however old, beat none
+        if entry is None:
+            raise
+        _count(source, "degraded")
+        return entry.value, 0
+    _count(source, "misses")
+    value = fetch_fn()
+    http_cache.put(key, value, policy.ttl)
+    return value, policy.cost_units
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        return {source: dict(counters) for source, counters in _counters.items()}
+
+
+def render_search_cache_dashboard():
+    import streamlit as st
+
+    rows = [
+        {
+            "source": source,
+            "hits": counters.get("hits", 0),
+            "stale hits": counters.get("stale_hits", 0),
+            "misses": counters.get("misses", 0),
+            "served over budget": counters.get("degraded", 0),
+            "background refreshes": counters.get("refreshes", 0),
+            "quota units saved": counters.get("units_saved", 0),
+        }
+        for source, counters in stats().items()
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+    else:
+        st.write("No searches since this worker started.")
@@ -0,0 +1,291 @@
+"""Byte accounting for st.session_state with least-recently-used spill to disk.
+
+Large per-session objects are stored with `put` and read back with `get`.
+They are held here, per session, rather than in st.session_state, so any
+session's cold values can be spilled safely: when the worker goes over its
+budget, the least recently used managed values across all sessions are
+pickled to the cache directory and loaded again by their owner's next
+`get`. The other keys of every session are sized on each of its reruns
+(`track_session`), but are never spilled.
+
+Objects loaded once per process by utils.models, such as the embedding
+model inside a retriever, are not counted against any session; retrievers
+pickle as their chunks and reload their indexes from the index cache.
+"""
+import hashlib
+import io
+import logging
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+
+from utils.settings import cache_dir
+
+logger = logging.getLogger(__name__)
+
+WORKER_BUDGET_BYTES = int(float(os.getenv("SHERLOCK_SESSION_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+# Values smaller than this are never worth a round trip to disk
+SPILL_MIN_BYTES = 256 * 1024
+# Stop descending into nested containers past this depth when sizing
+MAX_SIZE_DEPTH = 6
+
+
+@dataclass
+class SpilledValue:
+    path: str
+    size: int
+
+
+@dataclass
+class KeyStats:
+    size: int = 0
+    last_access: float = field(default_factory=time.time)
+    managed: bool = False
+    spillable: bool = True
+    spilled: bool = False
+
+
+@dataclass
+class SessionStats:
+    keys: Dict[str, KeyStats] = field(default_factory=dict)
+    # Values stored with `put`, or the SpilledValue standing in for them
+    values: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(stats.size for stats in self.keys.values() if not stats.spilled)
+
+    @property
+    def spilled_bytes(self) -> int:
+        return sum(stats.size for stats in self.keys.values() if stats.spilled)
+
+
+_lock = threading.RLock()
+_sessions: Dict[str, SessionStats] = {}
+
+
+def estimate_size(obj: Any, _depth: int = 0, _seen: Optional[set] = None) -> int:
+    """Approximate the memory held by `obj`, including what it references."""
+    if _seen is None:
+        from utils.models import loaded_handles
+
+        # Process-wide models are shared by every session, not held by this object
+        _seen = {id(handle) for handle in loaded_handles()}
+    if id(obj) in _seen or _depth > MAX_SIZE_DEPTH:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, (bytes, bytearray, str)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    if hasattr(obj, "nbytes") and isinstance(getattr(obj, "nbytes"), int):
+        return obj.nbytes
+    if hasattr(obj, "ntotal") and hasattr(obj, "d"):
+        # FAISS index: vectors live in native memory invisible to getsizeof
+        return int(obj.ntotal) * int(obj.d) * 4
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _depth + 1, _seen) + estimate_size(v, _depth + 1, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1, _seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), _depth + 1, _seen)
+    return size
+
+
+def _current_session():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None, None
+    return ctx.session_id, ctx.session_state
+
+
+def _session_stats(session_id: str) -> SessionStats:
+    stats = _sessions.get(session_id)
+    if stats is None:
+        stats = _sessions[session_id] = SessionStats()
+    return stats
+
+
+def _discard(value: Any):
+    if isinstance(value, SpilledValue) and os.path.exists(value.path):
+        os.unlink(value.path)
+
+
+def put(key: str, value: Any, spillable: bool = True):
+    """Store a large value for the current session under byte accounting."""
+    session_id, _ = _current_session()
+    if session_id is None:
+        st.session_state[key] = value
+        return
+    size = estimate_size(value)
+    with _lock:
+        stats = _session_stats(session_id)
+        _discard(stats.values.get(key))
+        stats.values[key] = value
+        stats.keys[key] = KeyStats(size=size, managed=True, spillable=spillable)
+    enforce_budget()
+
+
+def get(key: str, default: Any = None) -> Any:
+    """Read a value stored with `put`, loading it back from disk if it was spilled."""
+    session_id, _ = _current_session()
+    if session_id is None:
+        return st.session_state.get(key, default)
+    with _lock:
+        stats = _sessions.get(session_id)
+        if stats is None or key not in stats.values:
+            return default
+        value = stats.values[key]
+        stats.keys[key].last_access = time.time()
+    if not isinstance(value, SpilledValue):
+        return value
+
+    # Unpickling can rebuild a retriever's indexes; other sessions shouldn't wait on it
+    spilled = value
+    try:
+        with open(spilled.path, "rb") as f:
+            value = pickle.load(f)
+    except Exception as e:
+        logger.error(f"Lost spilled session value {key}: {e}")
+        pop(key)
+        return default
+    with _lock:
+        if stats.values.get(key) is spilled:
+            stats.values[key] = value
+            stats.keys[key].spilled = False
+            os.unlink(spilled.path)
+    return value
+
+
+def pop(key: str):
+    session_id, _ = _current_session()
+    if session_id is None:
+        st.session_state.pop(key, None)
+        return
+    with _lock:
+        stats = _sessions.get(session_id)
+        if stats is not None:
+            _discard(stats.values.pop(key, None))
+            stats.keys.pop(key, None)
+
+
+def track_session():
+    """Re-measure the current session's st.session_state keys; call once per rerun."""
+    session_id, state = _current_session()
+    if session_id is None:
+        return
+    keys = list(state.filtered_state.keys())
+    sizes = {key: estimate_size(state[key]) for key in keys}
+    with _lock:
+        stats = _session_stats(session_id)
+        for key, size in sizes.items():
+            key_stats = stats.keys.setdefault(key, KeyStats())
+            if not key_stats.managed:
+                key_stats.size = size
+        for key in [key for key, key_stats in stats.keys.items() if not key_stats.managed and key not in sizes]:
+            del stats.keys[key]
+    prune_sessions()
+    enforce_budget()
+
+
+def _spill(session_id: str, stats: SessionStats, key: str, key_stats: KeyStats) -> bool:
+    value = stats.values[key]
+    path = os.path.join(cache_dir("session_spill", session_id), hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pkl")
+    try:
+        with open(path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        # Values holding locks, sockets or other live handles cannot be pickled; keep them resident
+        logger.info(f"Cannot spill session value {key}: {e}")
+        key_stats.spillable = False
+        if os.path.exists(path):
+            os.unlink(path)
+        return False
+    stats.values[key] = SpilledValue(path, key_stats.size)
+    key_stats.spilled = True
+    logger.info(f"Spilled {key} ({key_stats.size} bytes) of session {session_id[:8]} to disk")
+    return True
+
+
+def worker_resident_bytes() -> int:
+    with _lock:
+        return sum(stats.resident_bytes for stats in _sessions.values())
+
+
+def enforce_budget(budget: int = WORKER_BUDGET_BYTES):
+    """Spill the worker's least recently used managed values, from any session, until it fits `budget`."""
+    with _lock:
+        resident = worker_resident_bytes()
+        if resident <= budget:
+            return
+        candidates = sorted(
+            (key_stats.last_access, session_id, key)
+            for session_id, stats in _sessions.items()
+            for key, key_stats in stats.keys.items()
+            if key_stats.managed and key_stats.spillable and not key_stats.spilled
+            and key_stats.size >= SPILL_MIN_BYTES
+        )
+        for _, session_id, key in candidates:
+            stats = _sessions[session_id]
+            key_stats = stats.keys[key]
+            if _spill(session_id, stats, key, key_stats):
+                resident -= key_stats.size
+            if resident <= budget:
+                return
+        logger.warning(f"Session memory {resident} bytes is over the {budget} byte budget with nothing left to spill")
+
+
+def prune_sessions():
+    """Forget sessions that have disconnected and delete their spill files."""
+    from streamlit import runtime
+
+    if not runtime.exists():
+        return
+    instance = runtime.get_instance()
+    with _lock:
+        for session_id in list(_sessions):
+            if not instance.is_active_session(session_id):
+                del _sessions[session_id]
+                shutil.rmtree(cache_dir("session_spill", session_id), ignore_errors=True)
+
+
+def largest_sessions(limit: int = 10) -> List[Dict[str, Any]]:
+    with _lock:
+        rows = [
+            {
+                "session": session_id[:8],
+                "resident_mb": stats.resident_bytes / 1024 / 1024,
+                "spilled_mb": stats.spilled_bytes / 1024 / 1024,
+                "largest_keys": ", ".join(
+                    f"{key} ({key_stats.size / 1024:.0f} KB{', on disk' if key_stats.spilled else ''})"
+                    for key, key_stats in sorted(stats.keys.items(), key=lambda item: -item[1].size)[:3]
+                ),
+            }
+            for session_id, stats in _sessions.items()
+        ]
+    return sorted(rows, key=lambda row: -(row["resident_mb"] + row["spilled_mb"]))[:limit]
+
+
+def render_memory_dashboard():
+    resident = worker_resident_bytes()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sessions", len(_sessions))
+    col2.metric("Resident memory", f"{resident / 1024 / 1024:.1f} MB")
+    col3.metric("Budget used", f"{100 * resident / WORKER_BUDGET_BYTES:.0f}%")
+    rows = largest_sessions()
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+    else:
+        st.write("No sessions tracked yet.")
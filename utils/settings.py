@@ -0,0 +1,24 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Root for everything the app persists between runs (indexes, caches, spills)
+CACHE_DIR = os.getenv("SHERLOCK_CACHE_DIR", os.path.join(PROJECT_ROOT, ".cache"))
+
+
+def cache_path(*parts: str) -> str:
+    """Return a path under CACHE_DIR, creating its parent directory."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def cache_dir(*parts: str) -> str:
+    """Return a directory under CACHE_DIR, creating it if needed."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,128 @@
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Any, List, Tuple
+
+from langchain.text_splitter import TextSplitter
+
+# Default model behind HuggingFaceEmbeddings(); it truncates inputs at 384 tokens
+DEFAULT_TOKENIZER = "sentence-transformers/all-mpnet-base-v2"
+
+# Roughly the old 1000/200 character settings, expressed in model tokens
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_CHUNK_OVERLAP = 48
+
+# Preferred places to end a chunk, strongest first
+BOUNDARY_PATTERNS = [
+    re.compile(r"\n\s*\n"),        # paragraph
+    re.compile(r"(?<=[.!?])\s+"),  # sentence
+    re.compile(r"\n"),             # line
+    re.compile(r"\s+"),            # word
+]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str = DEFAULT_TOKENIZER):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name, use_fast=True)
+
+
+def token_offsets(text: str, tokenizer) -> Tuple[List[int], List[int]]:
+    """Return the start and end character offsets of every token in `text`."""
+    encoding = tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+        verbose=False,
+    )
+    offsets = encoding["offset_mapping"]
+    return [start for start, _ in offsets], [end for _, end in offsets]
+
+
+def count_tokens(text: str, tokenizer_name: str = DEFAULT_TOKENIZER) -> int:
+    return len(token_offsets(text, get_tokenizer(tokenizer_name))[0])
+
+
+class ModelTokenTextSplitter(TextSplitter):
+    """Split text into chunks measured in embedding-model tokens.
+
+    The text is tokenized once and every boundary candidate is found with a
+    single regex pass, so chunking is a series of binary searches over
+    precomputed offsets instead of recursive re-splitting. The same input
+    always yields the same chunks.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+        tokenizer_name: str = DEFAULT_TOKENIZER,
+        **kwargs: Any,
+    ):
+        self._tokenizer_name = tokenizer_name
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=lambda text: count_tokens(text, tokenizer_name),
+            **kwargs,
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        starts, ends = token_offsets(text, get_tokenizer(self._tokenizer_name))
+        n_tokens = len(starts)
+        if n_tokens == 0:
+            return []
+
+        boundaries = [[m.end() for m in pattern.finditer(text)] for pattern in BOUNDARY_PATTERNS]
+        word_boundaries = boundaries[-1]
+
+        chunks = []
+        first = 0
+        while first < n_tokens:
+            last = first + self._chunk_size
+            if last >= n_tokens:
+                cut = len(text)
+                stop = n_tokens
+            else:
+                # Cut at the strongest boundary in the back half of the token window
+                limit = starts[last]
+                floor = ends[first + max(self._chunk_size // 2, 1) - 1]
+                cut = limit
+                for level in boundaries:
+                    k = bisect_right(level, limit) - 1
+                    if k >= 0 and level[k] > floor:
+                        cut = level[k]
+                        break
+                stop = bisect_left(starts, cut)
+
+            chunk = text[starts[first]:cut]
+            if self._strip_whitespace:
+                chunk = chunk.strip()
+            if chunk:
+                chunks.append(chunk)
+            if stop >= n_tokens:
+                break
+
+            # Start the overlap on a word boundary so no chunk begins mid-word
+            overlap_start = starts[max(stop - self._chunk_overlap, first + 1)]
+            k = bisect_left(word_boundaries, overlap_start)
+            if k < len(word_boundaries) and word_boundaries[k] < cut:
+                overlap_start = word_boundaries[k]
+            first = max(bisect_left(starts, overlap_start), first + 1)
+
+        return chunks
+
+
+def get_text_splitter(
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    tokenizer_name: str = DEFAULT_TOKENIZER,
+) -> ModelTokenTextSplitter:
+    return ModelTokenTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        tokenizer_name=tokenizer_name,
+    )
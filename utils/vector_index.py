@@ -0,0 +1,311 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from utils.settings import cache_dir
+
+logger = logging.getLogger(__name__)
+
+# Below this many chunks an exact scan is always fast enough
+FLAT_MAX_VECTORS = 10_000
+# Rough brute-force throughput (multiply-adds per millisecond) of one CPU core
+FLAT_FLOPS_PER_MS = 4_000_000
+# Latency targets at or below this use HNSW, above it the lighter IVF-Flat
+HNSW_LATENCY_MS = 10.0
+DEFAULT_LATENCY_TARGET_MS = 50.0
+
+# Optional compressed storage for shared indexes: "int8" (scalar) or "pq" (product)
+DEFAULT_QUANTIZATION = os.getenv("SHERLOCK_INDEX_QUANTIZATION") or None
+# PQ codebooks need a few thousand training points; smaller corpora fall back to int8
+PQ_MIN_VECTORS = 10_000
+# Candidates fetched from the compressed index per result before exact re-ranking
+RERANK_OVERSAMPLE = 4
+
+SPEC_FILE = "index_spec.json"
+VECTORS_FILE = "vectors.npy"
+# Uploaded documents' indexes are evicted least recently used first past this size
+MAX_CACHE_BYTES = int(float(os.getenv("SHERLOCK_INDEX_CACHE_MB", "1024")) * 1024 * 1024)
+# Metadata that differs between uploads of the same file (e.g. temp file paths)
+UNSTABLE_METADATA = {"source", "file_path"}
+
+
+@dataclass
+class IndexSpec:
+    kind: str  # "flat", "ivf_flat" or "hnsw"
+    dimension: int
+    n_vectors: int
+    nlist: int = 0
+    nprobe: int = 0
+    hnsw_m: int = 0
+    ef_search: int = 0
+    quantization: Optional[str] = None
+    pq_m: int = 0
+
+
+def choose_index_spec(
+    n_vectors: int,
+    dimension: int,
+    latency_target_ms: float = DEFAULT_LATENCY_TARGET_MS,
+    quantization: Optional[str] = DEFAULT_QUANTIZATION,
+) -> IndexSpec:
+    """Pick an index type for a corpus of `n_vectors` embeddings."""
+    estimated_flat_ms = n_vectors * dimension / FLAT_FLOPS_PER_MS
+    if n_vectors <= FLAT_MAX_VECTORS or estimated_flat_ms <= latency_target_ms / 4:
+        spec = IndexSpec("flat", dimension, n_vectors)
+    elif latency_target_ms <= HNSW_LATENCY_MS:
+        spec = IndexSpec("hnsw", dimension, n_vectors, hnsw_m=32, ef_search=64)
+    else:
+        nlist = int(4 * math.sqrt(n_vectors))
+        # Scan enough lists to keep recall high while staying inside the target
+        lists_in_budget = int(latency_target_ms / 4 * FLAT_FLOPS_PER_MS / dimension / (n_vectors / nlist))
+        nprobe = max(8, min(nlist // 8, lists_in_budget))
+        spec = IndexSpec("ivf_flat", dimension, n_vectors, nlist=nlist, nprobe=nprobe)
+
+    if quantization == "pq" and n_vectors < PQ_MIN_VECTORS:
+        quantization = "int8"
+    if quantization == "pq":
+        spec.pq_m = pq_subquantizers(dimension)
+    elif quantization not in (None, "int8"):
+        raise ValueError(f"Unknown quantization: {quantization}")
+    spec.quantization = quantization
+    return spec
+
+
+def pq_subquantizers(dimension: int) -> int:
+    # About 8 dimensions per one-byte code, e.g. 96 bytes per 768-dim vector
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def build_faiss_index(vectors: np.ndarray, spec: IndexSpec, seed: int = 0):
+    import faiss
+
+    d = spec.dimension
+    sq8 = faiss.ScalarQuantizer.QT_8bit
+    if spec.kind == "flat":
+        if spec.quantization == "int8":
+            index = faiss.IndexScalarQuantizer(d, sq8)
+        elif spec.quantization == "pq":
+            index = faiss.IndexPQ(d, spec.pq_m, 8)
+        else:
+            index = faiss.IndexFlatL2(d)
+    elif spec.kind == "hnsw":
+        if spec.quantization == "int8":
+            index = faiss.IndexHNSWSQ(d, sq8, spec.hnsw_m)
+        elif spec.quantization == "pq":
+            index = faiss.IndexHNSWPQ(d, spec.pq_m, spec.hnsw_m)
+        else:
+            index = faiss.IndexHNSWFlat(d, spec.hnsw_m)
+        index.hnsw.efConstruction = 2 * spec.hnsw_m
+    elif spec.kind == "ivf_flat":
+        quantizer = faiss.IndexFlatL2(d)
+        if spec.quantization == "int8":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, spec.nlist, sq8)
+        elif spec.quantization == "pq":
+            index = faiss.IndexIVFPQ(quantizer, d, spec.nlist, spec.pq_m, 8)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, d, spec.nlist)
+    else:
+        raise ValueError(f"Unknown index kind: {spec.kind}")
+
+    if not index.is_trained:
+        # FAISS wants 30-256 training points per centroid; a sample is plenty
+        n_train = min(len(vectors), 64 * max(spec.nlist, 256))
+        sample = np.random.default_rng(seed).choice(len(vectors), n_train, replace=False)
+        index.train(vectors[np.sort(sample)])
+
+    index.add(vectors)
+    apply_search_params(index, spec)
+    return index
+
+
+def index_bytes(index) -> int:
+    import faiss
+
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def memory_report(index, spec: IndexSpec) -> Dict[str, float]:
+    """Bytes per chunk of `index` next to the uncompressed float32 equivalent."""
+    n = max(index.ntotal, 1)
+    return {
+        "kind": spec.kind,
+        "quantization": spec.quantization or "none",
+        "chunks": index.ntotal,
+        "float32_bytes_per_chunk": spec.dimension * 4,
+        "index_bytes_per_chunk": index_bytes(index) / n,
+    }
+
+
+class RerankedIndex:
+    """Search a compressed index, then re-rank its candidates exactly.
+
+    The full-precision vectors stay on disk and are memory-mapped, so only
+    the rows for each query's candidates are paged in. Everything else is
+    delegated to the wrapped FAISS index.
+    """
+
+    def __init__(self, index, vectors_path: str, oversample: int = RERANK_OVERSAMPLE):
+        self.index = index
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+        self.oversample = oversample
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, queries: np.ndarray, k: int):
+        _, candidates = self.index.search(queries, k * self.oversample)
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        labels = np.full((len(queries), k), -1, dtype="int64")
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = np.sort(ids[ids >= 0])  # sorted ids read the memmap sequentially
+            exact = ((self.vectors[ids] - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            distances[row, :len(best)] = exact[best]
+            labels[row, :len(best)] = ids[best]
+        return distances, labels
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return np.array(self.vectors[i], dtype="float32")
+
+
+def apply_search_params(index, spec: IndexSpec):
+    import faiss
+
+    if spec.kind == "ivf_flat":
+        faiss.extract_index_ivf(index).nprobe = spec.nprobe
+    elif spec.kind == "hnsw":
+        index.hnsw.efSearch = spec.ef_search
+
+
+def documents_hash(documents: List[Document], embeddings) -> str:
+    digest = hashlib.sha256()
+    digest.update(str(getattr(embeddings, "model_name", type(embeddings).__name__)).encode("utf-8"))
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        metadata = {key: value for key, value in doc.metadata.items() if key not in UNSTABLE_METADATA}
+        digest.update(json.dumps(metadata, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def index_folder(documents: List[Document], embeddings) -> str:
+    """Cache directory shared by every index built from these chunks."""
+    return cache_dir("indexes", documents_hash(documents, embeddings))
+
+
+def touch(folder: str):
+    """Mark a cached index as just used, for `prune`."""
+    now = time.time()
+    os.utime(folder, (now, now))
+
+
+def prune(limit: int = MAX_CACHE_BYTES):
+    """Delete the least recently used cached indexes once they take up more than `limit`."""
+    root = cache_dir("indexes")
+    folders = []
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+        folders.append((os.stat(folder).st_mtime, size, folder))
+    total = sum(size for _, size, _ in folders)
+    for _, size, folder in sorted(folders):
+        if total <= limit:
+            break
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= size
+
+
+def save_vectorstore(vectorstore: FAISS, spec: IndexSpec, folder: str):
+    vectorstore.save_local(folder)
+    with open(os.path.join(folder, SPEC_FILE), "w") as f:
+        json.dump(asdict(spec), f)
+
+
+def load_vectorstore(folder: str, embeddings) -> Optional[FAISS]:
+    spec_file = os.path.join(folder, SPEC_FILE)
+    if not os.path.exists(spec_file):
+        return None
+    try:
+        with open(spec_file, "r") as f:
+            spec = IndexSpec(**json.load(f))
+        # Only indexes this app wrote itself are ever loaded from here
+        vectorstore = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        apply_search_params(vectorstore.index, spec)
+        if spec.quantization:
+            vectorstore.index = RerankedIndex(vectorstore.index, os.path.join(folder, VECTORS_FILE))
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable index cache {folder}: {e}")
+        return None
+    return vectorstore
+
+
+def build_vectorstore(
+    documents: List[Document],
+    embeddings,
+    latency_target_ms: float = DEFAULT_LATENCY_TARGET_MS,
+    persist: bool = True,
+    quantization: Optional[str] = DEFAULT_QUANTIZATION,
+) -> FAISS:
+    """Embed `documents` into a FAISS store whose index type fits the corpus size.
+
+    With `persist` the index and the chosen IndexSpec are saved under the
+    cache directory, keyed by the document contents, and reused on the next
+    call with the same chunks. A `quantization` of "int8" or "pq" keeps only
+    compressed codes in memory and re-ranks against full-precision vectors
+    memory-mapped from the cache, so it needs `persist`.
+    """
+    folder = None
+    if persist:
+        folder = index_folder(documents, embeddings)
+        cached = load_vectorstore(folder, embeddings)
+        if cached is not None:
+            touch(folder)
+            # Same chunks, but metadata such as the upload's temp path is this call's
+            cached.docstore = InMemoryDocstore({
+                cached.index_to_docstore_id[i]: doc for i, doc in enumerate(documents)
+            })
+            return cached
+    else:
+        quantization = None
+
+    vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]), dtype="float32")
+    spec = choose_index_spec(len(vectors), vectors.shape[1], latency_target_ms, quantization)
+    index = build_faiss_index(vectors, spec)
+    logger.info(f"Built index: {memory_report(index, spec)}")
+
+    ids = [str(i) for i in range(len(documents))]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+    if folder:
+        # The spec file is written last, so readers never see a half-saved index
+        vectors_path = os.path.join(folder, VECTORS_FILE)
+        if spec.quantization:
+            np.save(vectors_path, vectors)
+        save_vectorstore(vectorstore, spec, folder)
+        if spec.quantization:
+            vectorstore.index = RerankedIndex(index, vectors_path)
+    return vectorstore
+
+
+def build_vectorstore_from_texts(texts: List[str], embeddings, **kwargs) -> FAISS:
+    return build_vectorstore([Document(page_content=text) for text in texts], embeddings, **kwargs)
@@ -0,0 +1,187 @@
+"""Preload models and caches as the app process starts.
+
+The Procfile runs `python -m utils.warmup --serve app.py`, which starts the
+warmup steps on a daemon thread and then runs the Streamlit server in the
+same process. The server binds its port straight away (Heroku gives a dyno
+60 seconds to do so) while the models download and the in-process caches in
+utils.models fill behind it, before any browser has connected. app.py also
+calls `start_background()`, which does nothing if warmup already started
+and covers a plain `streamlit run app.py`.
+
+Each step is timed, and the report is rewritten to the cache directory as
+JSON after every step. READY_FILE is created there once every step has
+succeeded, for a platform health check to look for, and app.py holds a new
+session for up to WARMUP_GATE_SECONDS while warmup is still running.
+`python -m utils.warmup` on its own runs the steps in the foreground, for a
+build step or to check a machine by hand; it exits non-zero only with
+--strict, so a flaky download never keeps the app from starting.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from utils import google_api, http_cache, images, models, paper_store
+from utils.settings import cache_dir, cache_path
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = "warmup.json"
+READY_FILE = "warmup.ready"
+# How long a session's first page waits for a warmup still in progress
+WARMUP_GATE_SECONDS = 45
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+
+def warm_embeddings():
+    for model_name in (models.DEFAULT_EMBEDDING_MODEL, models.MINI_EMBEDDING_MODEL):
+        # One call is enough to download the weights and run the model end to end
+        models.get_embeddings(model_name).embed_query("warmup")
+
+
+def warm_face_cascade():
+    models.get_face_cascade()
+
+
+def warm_cache_databases():
+    from utils import vector_index
+
+    for name in ("indexes", "session_spill"):
+        cache_dir(name)
+    http_cache.prune()
+    images.prune()
+    vector_index.prune()
+    # Abstracts stored just before a restart may not have been embedded yet
+    paper_store.embed_pending()
+
+
+def warm_images():
+    # The home page shows the portrait to every new session
+    images.fetch_image(images.SHERLOCK_PORTRAIT_URL)
+
+
+def warm_google_clients():
+    # Parsing the discovery documents is the slow part of building a client
+    google_api.prewarm([("youtube", "v3"), ("customsearch", "v1")])
+
+
+STEPS: List[Tuple[str, Callable[[], Any]]] = [
+    ("embedding_models", warm_embeddings),
+    ("face_cascade", warm_face_cascade),
+    ("cache_databases", warm_cache_databases),
+    ("google_clients", warm_google_clients),
+    ("images", warm_images),
+]
+
+_lock = threading.Lock()
+_report: Dict[str, Dict[str, Any]] = {name: {"status": PENDING} for name, _ in STEPS}
+_thread = None
+_finished = threading.Event()
+
+
+def _write_report(report: Dict[str, Dict[str, Any]]):
+    path = cache_path(REPORT_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def run_steps() -> Dict[str, Dict[str, Any]]:
+    # A marker left by an earlier process says nothing about this one
+    if os.path.exists(cache_path(READY_FILE)):
+        os.unlink(cache_path(READY_FILE))
+    try:
+        for name, step in STEPS:
+            with _lock:
+                _report[name] = {"status": RUNNING}
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning(f"Warmup step {name} failed: {e}")
+                result = {"status": FAILED, "error": str(e)}
+            else:
+                result = {"status": READY}
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            logger.info(f"Warmup step {name}: {result['status']} in {result['seconds']}s")
+            with _lock:
+                _report[name] = result
+            _write_report(readiness())
+
+        if is_ready():
+            open(cache_path(READY_FILE), "w").close()
+        return readiness()
+    finally:
+        _finished.set()
+
+
+def start_background():
+    """Warm the in-process caches on a daemon thread, once per process."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=run_steps, name="warmup", daemon=True)
+    _thread.start()
+
+
+def wait(timeout: float) -> bool:
+    """Block until warmup has finished, or `timeout` seconds; returns whether it finished."""
+    return _finished.wait(timeout)
+
+
+def readiness() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {name: dict(result) for name, result in _report.items()}
+
+
+def is_ready() -> bool:
+    return all(result["status"] == READY for result in readiness().values())
+
+
+def render_readiness():
+    import streamlit as st
+
+    rows = [{"step": name, **result} for name, result in readiness().items()]
+    st.dataframe(rows, use_container_width=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preload models and caches before serving.")
+    parser.add_argument("--strict", action="store_true", help="exit non-zero if any step fails")
+    parser.add_argument("--serve", metavar="SCRIPT", help="warm up in the background while `streamlit run SCRIPT` serves")
+    args, streamlit_args = parser.parse_known_args()
+
+    if args.serve:
+        from streamlit.web import cli
+
+        # Under `python -m` this file is __main__; the app imports it as utils.warmup
+        from utils import warmup
+
+        warmup.start_background()
+        sys.argv = ["streamlit", "run", args.serve, *streamlit_args]
+        sys.exit(cli.main())
+
+    if streamlit_args:
+        parser.error(f"unrecognized arguments: {' '.join(streamlit_args)}")
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.perf_counter()
+    report = run_steps()
+    for name, result in report.items():
+        print(f"{name:>18}: {result['status']:<7} {result['seconds']:7.2f}s  {result.get('error', '')}")
+    print(f"{'total':>18}: {'ready' if is_ready() else 'degraded':<7} {time.perf_counter() - start:7.2f}s")
+    if args.strict and not is_ready():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()